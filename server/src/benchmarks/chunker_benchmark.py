@@ -0,0 +1,123 @@
+"""
+Сравнение скорости чанкинга: пословная токенизация против токенизации всего документа.
+
+Запуск из server/src:
+    python -m benchmarks.chunker_benchmark --pages 400
+    python -m benchmarks.chunker_benchmark --pdf path/to/document.pdf
+"""
+import argparse
+import random
+import time
+
+import fitz  # PyMuPDF
+
+from core.services.СhunksService import ChunkProcessor
+
+
+def legacy_chunks(processor: ChunkProcessor, text: str) -> list[str]:
+    """Прежний алгоритм: count_tokens на каждое слово и на каждое слово перекрытия."""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+    current_tokens = 0
+
+    for word in words:
+        word_tokens = processor.count_tokens(word + " ")
+
+        if current_tokens + word_tokens > processor.chunk_size and current_chunk:
+            chunks.append(" ".join(current_chunk))
+
+            overlap_words = []
+            overlap_tokens = 0
+            for w in reversed(current_chunk):
+                w_tokens = processor.count_tokens(w + " ")
+                if overlap_tokens + w_tokens > processor.overlap:
+                    break
+                overlap_words.insert(0, w)
+                overlap_tokens += w_tokens
+
+            current_chunk = overlap_words
+            current_tokens = overlap_tokens
+
+        current_chunk.append(word)
+        current_tokens += word_tokens
+
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+
+    return chunks
+
+
+def synthetic_text(pages: int, words_per_page: int = 350, seed: int = 42) -> str:
+    rnd = random.Random(seed)
+    vocabulary = (
+        "договор сторона обязательство оплата поставка услуга срок акт документ компания "
+        "заказчик исполнитель приложение пункт условие ответственность расчет счет период "
+        "contract payment invoice delivery service agreement clause section annex 2024 №15"
+    ).split()
+    return " ".join(rnd.choice(vocabulary) for _ in range(pages * words_per_page))
+
+
+def pdf_text(pdf_path: str) -> str:
+    doc = fitz.open(pdf_path)
+    full_text = " ".join(page.get_text() for page in doc)
+    doc.close()
+    return " ".join(full_text.split())
+
+
+def chunk_sizes(processor: ChunkProcessor, chunks: list[str]) -> list[int]:
+    """Реальная длина чанков в токенах энкодера, вместе со служебными."""
+    return [processor.count_tokens(chunk) for chunk in chunks]
+
+
+def describe(chunks: list[str], sizes: list[int]) -> str:
+    if not chunks:
+        return "0 чанков"
+    return f"{len(chunks)} чанков, токенов в чанке: среднее {sum(sizes) / len(sizes):.0f}, максимум {max(sizes)}"
+
+
+def compare(chunks: list[str], sizes: list[int], old_chunks: list[str], old_sizes: list[int]) -> str:
+    """Разница нарезки с прежним алгоритмом: совпадающие чанки и изменение размера."""
+    same = sum(new == old for new, old in zip(chunks, old_chunks, strict=False))
+    share = same / max(len(chunks), len(old_chunks), 1)
+    mean = sum(sizes) / max(len(sizes), 1)
+    old_mean = sum(old_sizes) / max(len(old_sizes), 1)
+    return (
+        f"Совпадает чанков: {same} из {len(old_chunks)} ({share:.0%}), "
+        f"чанков: {len(chunks) - len(old_chunks):+d}, "
+        f"среднее токенов в чанке: {mean - old_mean:+.0f}, "
+        f"максимум: {max(sizes, default=0) - max(old_sizes, default=0):+d}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400, help="Количество страниц синтетического документа")
+    parser.add_argument("--pdf", type=str, default=None, help="PDF для замера вместо синтетического текста")
+    parser.add_argument("--skip-legacy", action="store_true", help="Не запускать прежний алгоритм")
+    args = parser.parse_args()
+
+    processor = ChunkProcessor()
+    text = pdf_text(args.pdf) if args.pdf else synthetic_text(args.pages)
+    print(f"Документ: {len(text.split())} слов, {len(text)} символов")
+
+    started = time.perf_counter()
+    chunks = processor.create_chunks_with_overlap(text)
+    new_time = time.perf_counter() - started
+    sizes = chunk_sizes(processor, chunks)
+    print(f"Токенизация документа целиком: {new_time:.2f} c, {describe(chunks, sizes)}")
+
+    if args.skip_legacy:
+        return
+
+    started = time.perf_counter()
+    old_chunks = legacy_chunks(processor, text)
+    old_time = time.perf_counter() - started
+    old_sizes = chunk_sizes(processor, old_chunks)
+    print(f"Пословная токенизация: {old_time:.2f} c, {describe(old_chunks, old_sizes)}")
+    print(compare(chunks, sizes, old_chunks, old_sizes))
+    print(f"Ускорение: x{old_time / max(new_time, 1e-9):.1f}")
+
+
+if __name__ == "__main__":
+    main()
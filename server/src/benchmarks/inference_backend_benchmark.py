@@ -0,0 +1,53 @@
+"""
+Сравнение задержки эмбеддингов и реранкинга на бэкендах torch, onnx и onnx_int8.
+
+Для каждого бэкенда модель загружается через реестр (ONNX-варианты
+экспортируются и сверяются при первом запуске), затем замеряется кодирование
+одиночных запросов и реранкинг пачки кандидатов.
+
+Запуск из server/src:
+    python -m benchmarks.inference_backend_benchmark --backends torch,onnx,onnx_int8
+"""
+import argparse
+import time
+
+from config.Config import CONFIG
+from core.services.model_registry import get_cross_encoder, get_sentence_transformer
+from core.services.onnx_backend import PARITY_TEXTS
+
+
+def measure(func, repeats: int) -> tuple[float, float]:
+    func()
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=str, default="torch,onnx,onnx_int8", help="Бэкенды через запятую")
+    parser.add_argument("--repeats", type=int, default=50, help="Повторов каждого замера")
+    parser.add_argument("--candidates", type=int, default=20, help="Кандидатов на один реранкинг")
+    args = parser.parse_args()
+
+    query = PARITY_TEXTS[0]
+    pairs = [(query, PARITY_TEXTS[i % len(PARITY_TEXTS)]) for i in range(args.candidates)]
+
+    print(f"{'backend':>10} {'encode p50':>11} {'encode p95':>11} {'rerank p50':>11} {'rerank p95':>11}")
+    for backend in [item.strip() for item in args.backends.split(",") if item.strip()]:
+        encoder = get_sentence_transformer(CONFIG.qdrant.model_name, backend)
+        reranker = get_cross_encoder(CONFIG.reranker.model_name, CONFIG.reranker.max_length, backend)
+
+        encode_p50, encode_p95 = measure(lambda encoder=encoder: encoder.encode([query]), args.repeats)
+        rerank_p50, rerank_p95 = measure(
+            lambda reranker=reranker: reranker.predict(pairs, show_progress_bar=False), args.repeats
+        )
+        print(f"{backend:>10} {encode_p50:>11.1f} {encode_p95:>11.1f} {rerank_p50:>11.1f} {rerank_p95:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
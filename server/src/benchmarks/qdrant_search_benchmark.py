@@ -0,0 +1,118 @@
+"""
+Отчет о полноте и задержке поиска в Qdrant при разных hnsw_ef и oversampling.
+
+Эталон - точный поиск (exact=True) по той же коллекции, полнота считается как
+доля эталонных top-k, найденных приближенным поиском. Запросами служат тексты
+случайных чанков коллекции или строки файла --queries-file.
+
+Запуск из server/src:
+    python -m benchmarks.qdrant_search_benchmark --queries 200
+    python -m benchmarks.qdrant_search_benchmark --ef 32,64,128 --oversampling 1,2,4
+"""
+import argparse
+import random
+import statistics
+import time
+
+from qdrant_client.models import QuantizationSearchParams, SearchParams
+
+from core.services.QdrantService import SCROLL_PAGE_SIZE, QdrantService
+
+
+def sample_queries(service: QdrantService, count: int, seed: int = 42) -> list[str]:
+    texts = []
+    offset = None
+    while len(texts) < count * 5:
+        points, offset = service.client.scroll(
+            collection_name=service.collection_name,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=["text"],
+            with_vectors=False
+        )
+        texts.extend(point.payload["text"] for point in points if point.payload.get("text"))
+        if offset is None:
+            break
+
+    rnd = random.Random(seed)
+    return rnd.sample(texts, min(count, len(texts)))
+
+
+def run_searches(service: QdrantService, vectors: list[list[float]], top_k: int, params: SearchParams):
+    results = []
+    latencies = []
+    for vector in vectors:
+        started = time.perf_counter()
+        found = service.client.query_points(
+            collection_name=service.collection_name,
+            query=vector,
+            limit=top_k,
+            search_params=params
+        ).points
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append({point.id for point in found})
+    return results, latencies
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def parse_list(value: str, cast):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200, help="Количество запросов из чанков коллекции")
+    parser.add_argument("--queries-file", type=str, default=None, help="Файл с запросами, по одному на строку")
+    parser.add_argument("--top-k", type=int, default=None, help="Размер выдачи, по умолчанию qdrant.top_samples")
+    parser.add_argument("--ef", type=str, default="0,32,64,128,256", help="Значения hnsw_ef через запятую, 0 - по умолчанию")
+    parser.add_argument("--oversampling", type=str, default="1,2,4", help="Значения oversampling через запятую")
+    parser.add_argument("--no-rescore", action="store_true", help="Не пересчитывать оценки по исходным векторам")
+    args = parser.parse_args()
+
+    service = QdrantService()
+    top_k = args.top_k or service.top_samples
+
+    info = service.get_collection_info()
+    print(
+        f"Коллекция {service.collection_name}: точек {info.get('points_count')}, квантизация {service.quantization}, "
+        f"векторы на диске {service.on_disk_vectors}, hnsw m={service.hnsw_m} ef_construct={service.hnsw_ef_construct}"
+    )
+
+    if args.queries_file:
+        with open(args.queries_file, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_queries(service, args.queries)
+    if not queries:
+        print("Нет запросов: коллекция пуста")
+        return
+
+    vectors = [embedding.tolist() for embedding in service.model.encode(queries, batch_size=service.encode_batch_size)]
+    exact, exact_latencies = run_searches(service, vectors, top_k, SearchParams(exact=True))
+    print(f"Запросов: {len(queries)}, top-k: {top_k}, точный поиск: p50 {percentile(exact_latencies, 0.5):.1f} мс")
+
+    oversampling_values = parse_list(args.oversampling, float) if service.quantization != "none" else [None]
+
+    print(f"{'hnsw_ef':>8} {'oversampling':>12} {'recall':>8} {'p50, мс':>9} {'p95, мс':>9}")
+    for ef in parse_list(args.ef, int):
+        for oversampling in oversampling_values:
+            quantization = None
+            if oversampling is not None:
+                quantization = QuantizationSearchParams(rescore=not args.no_rescore, oversampling=oversampling)
+
+            found, latencies = run_searches(service, vectors, top_k, SearchParams(hnsw_ef=ef or None, quantization=quantization))
+            recall = statistics.mean(
+                len(approx & truth) / len(truth) for approx, truth in zip(found, exact, strict=True) if truth
+            )
+            print(
+                f"{ef or 'default':>8} {oversampling if oversampling is not None else '-':>12} {recall:>8.3f} "
+                f"{percentile(latencies, 0.5):>9.1f} {percentile(latencies, 0.95):>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
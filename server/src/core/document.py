@@ -1,13 +1,14 @@
+import hashlib
 from datetime import datetime
-from typing import Optional
-
-import fitz
+from typing import Callable, Optional
 
 from core.models.document_status import DocumentStatus
 from core.models.validation_result import ValidationResult
+from core.services.AnswerCache import AnswerCache
+from core.services.pdf_extraction import ParsedPdf
+from core.services.QdrantService import QdrantService
 from core.services.validators.document_validator import DocumentValidator
 from core.services.СhunksService import ChunkProcessor
-from core.services.QdrantService import QdrantService
 
 
 class Document:
@@ -22,7 +23,8 @@ class Document:
         status: DocumentStatus = DocumentStatus.UPLOADED,
         chunk_count: int = 0,
         page_count: int = 0,
-        file_size_mb: float = 0.0
+        file_size_mb: float = 0.0,
+        content_version: str = ""
     ):
         self._id: int = id
         self._user_id: int = user_id
@@ -33,6 +35,7 @@ class Document:
         self._chunk_count: int = chunk_count
         self._page_count: int = page_count
         self._file_size_mb: float = file_size_mb
+        self._content_version: str = content_version
 
     @property
     def id(self) -> int:
@@ -70,15 +73,22 @@ class Document:
     def file_size_mb(self) -> float:
         return self._file_size_mb
 
+    @property
+    def content_version(self) -> str:
+        return self._content_version
+
     # Методы валидации и обработки
-    def validate(self) -> ValidationResult:
+    def validate(self, pdf: Optional[ParsedPdf] = None) -> ValidationResult:
         """
         Валидирует документ перед обработкой.
 
+        Args:
+            pdf: Уже открытый документ для повторного использования
+
         Returns:
             ValidationResult: Результат валидации
         """
-        validator = DocumentValidator(self._file_path)
+        validator = DocumentValidator(self._file_path, pdf=pdf)
         return validator.validate()
 
     def is_ready_for_queries(self) -> bool:
@@ -108,26 +118,49 @@ class Document:
     def mark_as_failed(self) -> None:
         self._status = DocumentStatus.FAILED
 
+    @staticmethod
+    def _compute_content_version(pdf: ParsedPdf) -> str:
+        """Возвращает хэш содержимого файла, по которому инвалидируются кэшированные ответы"""
+        return hashlib.sha256(pdf.data).hexdigest()
+
     def process_for_rag(
         self,
         chunk_processor: ChunkProcessor,
-        qdrant_service: QdrantService
+        qdrant_service: QdrantService,
+        answer_cache: Optional[AnswerCache] = None,
+        on_progress: Optional[Callable[[int], None]] = None
     ) -> None:
         """
         Обрабатывает документ для RAG:
         1. Валидирует PDF
-        2. Извлекает текст и разбивает на чанки
-        3. Загружает чанки в Qdrant с embeddings
+        2. Извлекает текст постранично и разбивает на чанки
+        3. Загружает чанки в Qdrant с embeddings по мере их появления
+        4. Обновляет версию содержимого и сбрасывает кэш ответов
+
+        PDF читается и разбирается один раз на все шаги.
 
         Args:
             chunk_processor: Сервис для обработки чанков
             qdrant_service: Сервис для работы с векторной БД
+            answer_cache: Кэш ответов, который нужно сбросить по документу
+            on_progress: Вызывается с количеством загруженных чанков по ходу обработки
 
         Raises:
             ValueError: Если валидация не прошла
             Exception: При ошибке обработки
         """
-        validation_result = self.validate()
+        with ParsedPdf(self._file_path) as pdf:
+            self._process_for_rag(pdf, chunk_processor, qdrant_service, answer_cache, on_progress)
+
+    def _process_for_rag(
+        self,
+        pdf: ParsedPdf,
+        chunk_processor: ChunkProcessor,
+        qdrant_service: QdrantService,
+        answer_cache: Optional[AnswerCache],
+        on_progress: Optional[Callable[[int], None]]
+    ) -> None:
+        validation_result = self.validate(pdf)
         if not validation_result.is_valid:
             self.mark_as_failed()
             raise ValueError(
@@ -137,20 +170,31 @@ class Document:
         try:
             self.mark_as_processing()
 
-            chunks = chunk_processor.process_pdf(self._file_path, title=self._filename)
+            chunks = chunk_processor.iter_pdf_chunks(self._file_path, title=self._filename, pdf=pdf)
 
-            if not chunks:
+            uploaded_count = qdrant_service.add_chunks_directly(
+                chunks,
+                document_id=self._id,
+                user_id=self._user_id,
+                on_progress=on_progress
+            )
+
+            if not uploaded_count:
                 self.mark_as_failed()
                 raise ValueError("Failed to process PDF: no chunks created")
 
-            uploaded_count = qdrant_service.add_chunks_directly(chunks)
+            page_count = pdf.page_count
 
-            doc = fitz.open(self._file_path)
-            page_count = len(doc)
-            doc.close()
+            self._content_version = self._compute_content_version(pdf)
+            if answer_cache is not None:
+                answer_cache.invalidate_document(self._id)
 
             self.mark_as_ready(chunk_count=uploaded_count, page_count=page_count)
 
+        except ValueError:
+            self.mark_as_failed()
+            raise
+
         except Exception as e:
             self.mark_as_failed()
-            raise Exception(f"Document processing failed: {str(e)}")
+            raise Exception(f"Document processing failed: {str(e)}") from e
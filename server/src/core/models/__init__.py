@@ -7,6 +7,7 @@ from core.models.transaction_status import TransactionStatus
 from core.models.validation_result import ValidationResult
 from core.models.transaction_history_item import TransactionHistoryItem
 from core.models.query_history_item import QueryHistoryItem
+from core.models.ingestion_job import IngestionJob
 
 from core.user import User
 from core.document import Document
@@ -22,6 +23,7 @@ __all__ = [
     "ValidationResult",
     "TransactionHistoryItem",
     "QueryHistoryItem",
+    "IngestionJob",
     "User",
     "Document",
     "Query",
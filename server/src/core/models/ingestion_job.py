@@ -0,0 +1,63 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from core.models.document_status import DocumentStatus
+
+
+@dataclass
+class IngestionJob:
+    id: str
+    document_id: int
+    user_id: int
+    filename: str
+    file_path: str
+    status: DocumentStatus = DocumentStatus.UPLOADED
+    attempts: int = 0
+    chunks_processed: int = 0
+    chunk_count: int = 0
+    page_count: int = 0
+    content_version: str = ""
+    error: Optional[str] = None
+    retry_at: Optional[datetime] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "document_id": self.document_id,
+            "user_id": self.user_id,
+            "filename": self.filename,
+            "file_path": self.file_path,
+            "status": self.status.value,
+            "attempts": self.attempts,
+            "chunks_processed": self.chunks_processed,
+            "chunk_count": self.chunk_count,
+            "page_count": self.page_count,
+            "content_version": self.content_version,
+            "error": self.error,
+            "retry_at": self.retry_at.isoformat() if self.retry_at else None,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IngestionJob":
+        return cls(
+            id=data["id"],
+            document_id=data["document_id"],
+            user_id=data["user_id"],
+            filename=data["filename"],
+            file_path=data["file_path"],
+            status=DocumentStatus(data["status"]),
+            attempts=data.get("attempts", 0),
+            chunks_processed=data.get("chunks_processed", 0),
+            chunk_count=data.get("chunk_count", 0),
+            page_count=data.get("page_count", 0),
+            content_version=data.get("content_version", ""),
+            error=data.get("error"),
+            retry_at=datetime.fromisoformat(data["retry_at"]) if data.get("retry_at") else None,
+            created_at=datetime.fromisoformat(data["created_at"]),
+            updated_at=datetime.fromisoformat(data["updated_at"])
+        )
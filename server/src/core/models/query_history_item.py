@@ -18,6 +18,7 @@ class QueryHistoryItem:
     total_tokens: int
     timestamp: datetime
     status: QueryStatus
+    from_cache: bool = False
 
     def to_dict(self) -> dict:
         return {
@@ -31,5 +32,6 @@ class QueryHistoryItem:
             "output_tokens": self.output_tokens,
             "total_tokens": self.total_tokens,
             "timestamp": self.timestamp.isoformat(),
-            "status": self.status.value
+            "status": self.status.value,
+            "from_cache": self.from_cache
         }
\ No newline at end of file
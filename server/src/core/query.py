@@ -1,20 +1,25 @@
+import asyncio
 from datetime import datetime
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
 
 from core.models.query_status import QueryStatus
 from core.models.validation_result import ValidationResult
 from core.services.validators.balance_validator import BalanceValidator
 from core.user import User
 from core.document import Document
-from core.services.LLMService import LLMService
+from core.services.LLMService import LLMService, LLMUsage
 from core.services.QdrantService import QdrantService
 from core.services.RerankerService import RerankerService
+from core.services.AnswerCache import AnswerCache, CachedAnswer
 from utils.prompt_loader import render_prompt
 
 
 class Query:
 
     COST_PER_1000_TOKENS: float = 100.0  # рублей за 1000 токенов
+    CACHE_HIT_COST_FACTOR: float = 0.1  # доля стоимости для ответа из кэша
+    MIN_QUERY_COST: float = 0.01  # минимальная ненулевая стоимость после округления
+    CHARS_PER_TOKEN_ESTIMATE: int = 4  # оценка токенов оборванного потока, когда LLM не прислала usage
 
     def __init__(
         self,
@@ -28,7 +33,8 @@ class Query:
         output_tokens: int = 0,
         total_tokens: int = 0,
         timestamp: Optional[datetime] = None,
-        status: QueryStatus = QueryStatus.PENDING
+        status: QueryStatus = QueryStatus.PENDING,
+        from_cache: bool = False
     ):
         self._id: int = id
         self._user_id: int = user_id
@@ -41,6 +47,7 @@ class Query:
         self._total_tokens: int = total_tokens
         self._timestamp: datetime = timestamp or datetime.now()
         self._status: QueryStatus = status
+        self._from_cache: bool = from_cache
 
     @property
     def id(self) -> int:
@@ -86,6 +93,10 @@ class Query:
     def timestamp(self) -> datetime:
         return self._timestamp
 
+    @property
+    def from_cache(self) -> bool:
+        return self._from_cache
+
     # Методы расчета стоимости
     @staticmethod
     def calculate_cost_from_tokens(total_tokens: int) -> float:
@@ -108,8 +119,11 @@ class Query:
         Рассчитывает полную стоимость запроса на основе токенов.
 
         Использует:
-        - self._input_tokens (из LLMService.total_input_token)
-        - self._output_tokens (из LLMService.total_output_token)
+        - self._input_tokens (из LLMUsage вызова LLM)
+        - self._output_tokens (из LLMUsage вызова LLM)
+
+        Ответ из кэша тарифицируется долей CACHE_HIT_COST_FACTOR
+        от стоимости исходной генерации.
 
         Args:
             user: Пользователь, выполняющий запрос
@@ -124,6 +138,8 @@ class Query:
         self._total_tokens = total
 
         cost = self.calculate_cost_from_tokens(total)
+        if self._from_cache:
+            cost = round(cost * self.CACHE_HIT_COST_FACTOR, 2)
         return cost
 
     async def execute(
@@ -132,22 +148,24 @@ class Query:
         document: 'Document',
         llm_service: 'LLMService',
         qdrant_service: 'QdrantService',
-        reranker_service: 'RerankerService'
+        reranker_service: 'RerankerService',
+        answer_cache: Optional['AnswerCache'] = None
     ) -> str:
         """
         Выполняет запрос к документу через RAG pipeline.
 
         Последовательность:
         1. Проверяет готовность документа
-        2. Получает релевантные чанки (QdrantService)
-        3. Переранжирует результаты (RerankerService)
-        4. Формирует контекст
-        5. Выполняет запрос к LLM
-        6. Получает токены из LLMService
-        7. Рассчитывает стоимость
-        8. Валидирует баланс
-        9. Списывает средства (только если баланс положительный)
-        10. Сохраняет результат
+        2. Ищет готовый ответ в кэше (AnswerCache), при попадании переходит к п.8
+        3. Получает релевантные чанки (QdrantService)
+        4. Переранжирует результаты (RerankerService)
+        5. Формирует контекст
+        6. Выполняет запрос к LLM
+        7. Получает токены этого вызова LLM
+        8. Рассчитывает стоимость
+        9. Валидирует баланс
+        10. Списывает средства (только если баланс положительный)
+        11. Сохраняет результат (и кладет ответ в кэш)
 
         Args:
             user: Пользователь, выполняющий запрос
@@ -155,6 +173,7 @@ class Query:
             llm_service: Сервис для работы с LLM
             qdrant_service: Сервис для работы с векторной БД
             reranker_service: Сервис для переранжирования результатов
+            answer_cache: Кэш готовых ответов (опционально)
 
         Returns:
             str: Ответ на вопрос
@@ -170,38 +189,241 @@ class Query:
 
         try:
             self._status = QueryStatus.PROCESSING
+            self._validate_can_start(user)
+
+            question_embedding = await qdrant_service.embed_query_async(self._question)
+
+            if answer_cache is not None:
+                cached = answer_cache.lookup(
+                    document.id,
+                    document.content_version,
+                    self._question,
+                    question_embedding
+                )
+                if cached is not None:
+                    return self._complete_from_cache(user, cached)
 
-            search_results = qdrant_service.search_similar(self._question)
+            prompt = await self._build_prompt(document, qdrant_service, reranker_service, question_embedding)
+
+            completion = await llm_service.fetch_completion(prompt)
+
+            self._complete(user, document, completion.content, completion.usage, answer_cache, question_embedding)
+
+            return completion.content
+
+        except ValueError:
+            self._status = QueryStatus.FAILED
+            raise
 
-            if not search_results:
-                raise ValueError("No relevant chunks found in the document")
+        except Exception as e:
+            self._status = QueryStatus.FAILED
+            if hasattr(self, '_cost') and self._cost > 0:
+                user.add_balance(self._cost)
+            raise Exception(f"Query execution failed: {str(e)}") from e
+
+    async def execute_stream(
+        self,
+        user: 'User',
+        document: 'Document',
+        llm_service: 'LLMService',
+        qdrant_service: 'QdrantService',
+        reranker_service: 'RerankerService',
+        answer_cache: Optional['AnswerCache'] = None
+    ) -> AsyncIterator[str]:
+        """
+        Выполняет запрос к документу, отдавая ответ LLM фрагментами по мере генерации.
 
-            documents_for_rerank = [result['text'] for result in search_results]
+        Последовательность та же, что в execute. Ответ из кэша отдается одним фрагментом.
+        Активность и баланс пользователя проверяются до поиска чанков и начала потока,
+        а стоимость списывается после его окончания, когда известны токены из
+        последнего чанка: уже отданный ответ оплачивается, даже если баланс уйдет в минус.
+        Если клиент отключился посреди потока, запрос помечается FAILED, а отданная
+        часть оплачивается по токенам из usage или по их оценке.
 
-            reranked_results = reranker_service.rerank(
-                query=self._question,
-                documents=documents_for_rerank
+        Args:
+            user: Пользователь, выполняющий запрос
+            document: Документ, к которому задается вопрос
+            llm_service: Сервис для работы с LLM
+            qdrant_service: Сервис для работы с векторной БД
+            reranker_service: Сервис для переранжирования результатов
+            answer_cache: Кэш готовых ответов (опционально)
+
+        Yields:
+            str: Очередной фрагмент ответа
+
+        Raises:
+            ValueError: Если документ не готов или баланс недостаточен
+            Exception: При ошибке выполнения запроса
+        """
+        if not document.is_ready_for_queries():
+            raise ValueError(
+                f"Document {document.id} is not ready for queries. Status: {document.status.value}"
             )
 
-            context = self._build_context(reranked_results)
+        try:
+            self._status = QueryStatus.PROCESSING
+            self._validate_can_start(user)
+
+            question_embedding = await qdrant_service.embed_query_async(self._question)
+
+            if answer_cache is not None:
+                cached = answer_cache.lookup(
+                    document.id,
+                    document.content_version,
+                    self._question,
+                    question_embedding
+                )
+                if cached is not None:
+                    yield self._complete_from_cache(user, cached)
+                    return
+
+            prompt = await self._build_prompt(document, qdrant_service, reranker_service, question_embedding)
+
+            usage = LLMUsage()
+            parts = []
+            streamed = False
+            try:
+                async for delta in llm_service.stream_completion(prompt, usage=usage):
+                    parts.append(delta)
+                    yield delta
+                streamed = True
+            except (GeneratorExit, asyncio.CancelledError):
+                # Клиент отключился: уже отданная часть ответа оплачивается
+                if parts:
+                    self._charge_interrupted(user, prompt, "".join(parts), usage)
+                raise
+            finally:
+                # Оборванный поток не оставляет запрос в PROCESSING
+                if not streamed:
+                    self._status = QueryStatus.FAILED
+
+            self._complete(user, document, "".join(parts), usage, answer_cache, question_embedding, allow_debt=True)
+
+        except ValueError:
+            self._status = QueryStatus.FAILED
+            raise
+
+        except Exception as e:
+            self._status = QueryStatus.FAILED
+            if hasattr(self, '_cost') and self._cost > 0:
+                user.add_balance(self._cost)
+            raise Exception(f"Query execution failed: {str(e)}") from e
+
+    async def _build_prompt(
+        self,
+        document: 'Document',
+        qdrant_service: 'QdrantService',
+        reranker_service: 'RerankerService',
+        question_embedding: List[float]
+    ) -> str:
+        """
+        Находит и переранжирует чанки документа и собирает из них промпт.
 
-            prompt = render_prompt("rag_answer_prompt").format(
-                data=context,
-                question=self._question
+        Raises:
+            ValueError: Если в документе не найдено релевантных чанков
+        """
+        search_results = await qdrant_service.search_similar_async(
+            self._question,
+            document_id=document.id,
+            user_id=document.user_id,
+            query_embedding=question_embedding
+        )
+
+        if not search_results:
+            raise ValueError("No relevant chunks found in the document")
+
+        reranked_results = await reranker_service.rerank_async(
+            query=self._question,
+            documents=[result['text'] for result in search_results],
+            vector_scores=[result['score'] for result in search_results]
+        )
+
+        context = self._build_context(reranked_results)
+
+        return render_prompt("rag_answer_prompt").format(
+            data=context,
+            question=self._question
+        )
+
+    def _complete(
+        self,
+        user: 'User',
+        document: 'Document',
+        answer: str,
+        usage: 'LLMUsage',
+        answer_cache: Optional['AnswerCache'],
+        question_embedding: List[float],
+        allow_debt: bool = False
+    ) -> None:
+        """Записывает токены вызова LLM, списывает стоимость и сохраняет ответ."""
+        self._input_tokens = usage.input_tokens
+        self._output_tokens = usage.output_tokens
+        self._total_tokens = self._input_tokens + self._output_tokens
+
+        self._charge(user, allow_debt=allow_debt)
+
+        self._answer = answer
+        self._status = QueryStatus.COMPLETED
+
+        if answer_cache is not None:
+            answer_cache.store(
+                document.id,
+                document.content_version,
+                self._question,
+                answer,
+                self._input_tokens,
+                self._output_tokens,
+                question_embedding
             )
 
-            llm_service.total_input_token = 0
-            llm_service.total_output_token = 0
+    def _complete_from_cache(self, user: 'User', cached: 'CachedAnswer') -> str:
+        """
+        Завершает запрос ответом из кэша без обращения к Qdrant, реранкеру и LLM.
 
-            answer = await llm_service.fetch_completion(prompt)
+        Токены берутся из исходной генерации, стоимость считается
+        по тарифу для кэшированных ответов.
+        """
+        self._from_cache = True
+        self._input_tokens = cached.input_tokens
+        self._output_tokens = cached.output_tokens
+        self._total_tokens = self._input_tokens + self._output_tokens
 
-            self._input_tokens = llm_service.total_input_token
-            self._output_tokens = llm_service.total_output_token
-            self._total_tokens = self._input_tokens + self._output_tokens
+        self._charge(user)
 
-            cost = self.calculate_cost(user)
-            self._cost = cost
+        self._answer = cached.answer
+        self._status = QueryStatus.COMPLETED
 
+        return cached.answer
+
+    def _validate_can_start(self, user: 'User') -> None:
+        """
+        Проверяет до обращения к LLM, что пользователь активен и может оплатить хотя бы минимальный запрос.
+
+        Raises:
+            ValueError: Если аккаунт неактивен или баланс не положительный
+        """
+        validation_result: ValidationResult = BalanceValidator(user, self.MIN_QUERY_COST).validate()
+
+        if not validation_result.is_valid:
+            raise ValueError(
+                f"Cannot start query: {validation_result.get_error_message()}"
+            )
+
+    def _charge(self, user: 'User', allow_debt: bool = False) -> None:
+        """
+        Рассчитывает стоимость, валидирует баланс и списывает средства.
+
+        Args:
+            user: Пользователь, выполняющий запрос
+            allow_debt: Списать, даже если средств не хватает (ответ уже отдан клиенту)
+
+        Raises:
+            ValueError: Если баланс недостаточен и allow_debt не задан
+        """
+        cost = self.calculate_cost(user)
+        self._cost = cost
+
+        if not allow_debt:
             balance_validator = BalanceValidator(user, cost)
             validation_result: ValidationResult = balance_validator.validate()
 
@@ -211,22 +433,23 @@ class Query:
                     f"Cannot complete query: {validation_result.get_error_message()}"
                 )
 
-            user.deduct_balance(cost)
-
-            self._answer = answer
-            self._status = QueryStatus.COMPLETED
-
-            return answer
+        user.deduct_balance(cost)
 
-        except ValueError as e:
-            self._status = QueryStatus.FAILED
-            raise
+    def _charge_interrupted(self, user: 'User', prompt: str, partial_answer: str, usage: 'LLMUsage') -> None:
+        """
+        Списывает стоимость уже отданной части ответа оборванного потока.
 
-        except Exception as e:
-            self._status = QueryStatus.FAILED
-            if hasattr(self, '_cost') and self._cost > 0:
-                user.add_balance(self._cost)
-            raise Exception(f"Query execution failed: {str(e)}")
+        Если LLM не успела прислать usage, токены оцениваются по длине промпта и ответа.
+        """
+        self._answer = partial_answer
+        if usage.total_tokens:
+            self._input_tokens = usage.input_tokens
+            self._output_tokens = usage.output_tokens
+        else:
+            self._input_tokens = len(prompt) // self.CHARS_PER_TOKEN_ESTIMATE
+            self._output_tokens = len(partial_answer) // self.CHARS_PER_TOKEN_ESTIMATE
+
+        self._charge(user, allow_debt=True)
 
     def _build_context(self, reranked_results: List[tuple]) -> str:
         """
@@ -0,0 +1,208 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.Config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("AnswerCache")
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    input_tokens: int
+    output_tokens: int
+    created_at: float
+    similarity: float = 1.0
+
+
+class AnswerCache:
+    """
+    Кэш ответов LLM перед вызовом LLMService в Query.execute.
+
+    Ключ - документ, версия его содержимого и нормализованный вопрос.
+    Точное совпадение проверяется первым; при включенном семантическом
+    уровне ищется ранее заданный вопрос к той же версии документа с
+    косинусной близостью эмбеддингов не ниже порога.
+    """
+
+    def __init__(self):
+        self.max_size: int = CONFIG.answer_cache.max_size
+        self.ttl: int = CONFIG.answer_cache.ttl
+        self.semantic_enabled: bool = CONFIG.answer_cache.semantic_enabled
+        self.similarity_threshold: float = CONFIG.answer_cache.similarity_threshold
+
+        self._items: OrderedDict[str, Tuple[Tuple[int, str], CachedAnswer]] = OrderedDict()
+        self._vectors: Dict[Tuple[int, str], Dict[str, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+        self.exact_hits: int = 0
+        self.semantic_hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def make_key(document_id: int, content_version: str, question: str) -> str:
+        normalized = " ".join(question.lower().split())
+        return hashlib.sha256(f"{document_id}\0{content_version}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def lookup(
+        self,
+        document_id: int,
+        content_version: str,
+        question: str,
+        question_embedding: Optional[List[float]] = None
+    ) -> Optional[CachedAnswer]:
+        """
+        Ищет готовый ответ на вопрос к документу.
+
+        Args:
+            document_id: Документ
+            content_version: Версия содержимого документа
+            question: Вопрос пользователя
+            question_embedding: Эмбеддинг вопроса для семантического уровня
+
+        Returns:
+            Optional[CachedAnswer]: Ответ из кэша или None
+        """
+        if not self.enabled:
+            return None
+
+        key = self.make_key(document_id, content_version, question)
+        now = time.time()
+
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if not self._is_expired(item[1], now):
+                    self._items.move_to_end(key)
+                    self.exact_hits += 1
+                    return item[1]
+                self._evict(key)
+
+            if self.semantic_enabled and question_embedding is not None:
+                similar = self._find_similar((document_id, content_version), question_embedding, now)
+                if similar is not None:
+                    self.semantic_hits += 1
+                    return similar
+
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        document_id: int,
+        content_version: str,
+        question: str,
+        answer: str,
+        input_tokens: int,
+        output_tokens: int,
+        question_embedding: Optional[List[float]] = None
+    ) -> None:
+        if not self.enabled:
+            return
+
+        key = self.make_key(document_id, content_version, question)
+        document_key = (document_id, content_version)
+        entry = CachedAnswer(
+            answer=answer,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            created_at=time.time()
+        )
+
+        with self._lock:
+            self._items[key] = (document_key, entry)
+            self._items.move_to_end(key)
+
+            if self.semantic_enabled and question_embedding is not None:
+                self._vectors.setdefault(document_key, {})[key] = self._normalize(question_embedding)
+
+            while len(self._items) > self.max_size:
+                self._evict(next(iter(self._items)))
+
+    def invalidate_document(self, document_id: int) -> int:
+        """
+        Удаляет все ответы по документу (например, после повторной обработки).
+
+        Returns:
+            int: Количество удаленных ответов
+        """
+        with self._lock:
+            keys = [key for key, (document_key, _) in self._items.items() if document_key[0] == document_id]
+            for key in keys:
+                self._evict(key)
+
+        if keys:
+            log.info(f"Кэш ответов документа {document_id} сброшен: {len(keys)} записей")
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+            }
+
+    def _find_similar(
+        self,
+        document_key: Tuple[int, str],
+        question_embedding: List[float],
+        now: float
+    ) -> Optional[CachedAnswer]:
+        vectors = self._vectors.get(document_key)
+        if not vectors:
+            return None
+
+        keys = list(vectors.keys())
+        similarities = np.stack([vectors[key] for key in keys]) @ self._normalize(question_embedding)
+        best = int(np.argmax(similarities))
+
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        key = keys[best]
+        entry = self._items[key][1]
+        if self._is_expired(entry, now):
+            self._evict(key)
+            return None
+
+        self._items.move_to_end(key)
+        return CachedAnswer(
+            answer=entry.answer,
+            input_tokens=entry.input_tokens,
+            output_tokens=entry.output_tokens,
+            created_at=entry.created_at,
+            similarity=float(similarities[best])
+        )
+
+    def _evict(self, key: str) -> None:
+        document_key, _ = self._items.pop(key)
+        vectors = self._vectors.get(document_key)
+        if vectors is not None:
+            vectors.pop(key, None)
+            if not vectors:
+                del self._vectors[document_key]
+
+    def _is_expired(self, entry: CachedAnswer, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created_at > self.ttl
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
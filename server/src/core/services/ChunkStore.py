@@ -0,0 +1,217 @@
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+log = get_logger("ChunkStore")
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.json"
+# Файлы чанков в формате до хранилища (json-файл на чанк), их можно заменить хранилищем
+LEGACY_CHUNK_PATTERN = "*_chunk_*.json"
+STORE_FORMAT_VERSION = 1
+
+
+class ChunkStoreWriter:
+    """
+    Пишет чанки в хранилище: шарды JSONL по shard_size строк, индекс
+    chunk_id -> (шард, строка, смещение, длина) и манифест.
+
+    Запись идет во временную директорию рядом с store_dir, которая при close()
+    подменяет store_dir целиком; читатели не видят наполовину записанное хранилище.
+    """
+
+    def __init__(self, store_dir: str, shard_size: int = 10000):
+        """
+        Args:
+            store_dir: Директория хранилища
+            shard_size: Максимум чанков в одном шарде
+        """
+        self._store_dir: Path = Path(store_dir)
+        self._tmp_dir: Path = self._store_dir.with_name(f"{self._store_dir.name}.tmp-{os.getpid()}")
+        self._shard_size: int = shard_size
+
+        self._index: Dict[str, Tuple[int, int, int, int]] = {}
+        self._shards: List[Dict[str, Any]] = []
+        self._shard_file = None
+        self._shard_offset: int = 0
+        self._shard_rows: int = 0
+
+        if self._tmp_dir.exists():
+            shutil.rmtree(self._tmp_dir)
+        self._tmp_dir.mkdir(parents=True)
+
+    def add(self, chunk: Dict[str, Any]) -> None:
+        """
+        Args:
+            chunk: Чанк с обязательным полем chunk_id
+        """
+        chunk_id = chunk["chunk_id"]
+        if chunk_id in self._index:
+            raise ValueError(f"Duplicate chunk_id: {chunk_id}")
+
+        if self._shard_file is None:
+            self._open_shard()
+
+        line = json.dumps(chunk, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._shard_file.write(line)
+        self._index[chunk_id] = (len(self._shards) - 1, self._shard_rows, self._shard_offset, len(line) - 1)
+        self._shard_offset += len(line)
+        self._shard_rows += 1
+
+        if self._shard_rows >= self._shard_size:
+            self._close_shard()
+
+    def close(self) -> int:
+        """
+        Дописывает индекс и манифест и публикует хранилище.
+
+        Существующая store_dir заменяется, только если в ней лежит хранилище
+        или чанки в старом формате.
+
+        Returns:
+            int: Количество чанков в хранилище
+
+        Raises:
+            ValueError: Если store_dir - посторонняя директория
+        """
+        self._close_shard()
+
+        if not self._is_replaceable(self._store_dir):
+            self.abort()
+            raise ValueError(
+                f"{self._store_dir} exists and is not a chunk store, refusing to replace it; "
+                f"choose another directory or remove it"
+            )
+
+        with open(self._tmp_dir / INDEX_FILE, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False, separators=(",", ":"))
+
+        with open(self._tmp_dir / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": STORE_FORMAT_VERSION,
+                "count": len(self._index),
+                "shards": self._shards
+            }, f, ensure_ascii=False, indent=2)
+
+        old_dir = self._store_dir.with_name(f"{self._store_dir.name}.old-{os.getpid()}")
+        if self._store_dir.exists():
+            self._store_dir.rename(old_dir)
+        self._tmp_dir.rename(self._store_dir)
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+
+        log.info(f"Хранилище чанков {self._store_dir} записано: {len(self._index)} чанков, шардов: {len(self._shards)}")
+        return len(self._index)
+
+    def abort(self) -> None:
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _is_replaceable(store_dir: Path) -> bool:
+        if not store_dir.exists():
+            return True
+        if not store_dir.is_dir():
+            return False
+        if (store_dir / MANIFEST_FILE).exists():
+            return True
+        return all(path.is_file() and path.match(LEGACY_CHUNK_PATTERN) for path in store_dir.iterdir())
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open_shard(self) -> None:
+        name = f"chunks-{len(self._shards):05d}.jsonl"
+        self._shard_file = open(self._tmp_dir / name, "wb")
+        self._shards.append({"file": name, "count": 0})
+        self._shard_offset = 0
+        self._shard_rows = 0
+
+    def _close_shard(self) -> None:
+        if self._shard_file is None:
+            return
+
+        self._shard_file.close()
+        self._shard_file = None
+        self._shards[-1]["count"] = self._shard_rows
+
+
+class ChunkStore:
+    """
+    Чтение хранилища чанков: потоковый обход шардов и доступ к чанку
+    по chunk_id через mmap шарда без разбора остальных строк.
+    """
+
+    def __init__(self, store_dir: str):
+        self._store_dir: Path = Path(store_dir)
+
+        with open(self._store_dir / MANIFEST_FILE, encoding="utf-8") as f:
+            self._manifest: Dict[str, Any] = json.load(f)
+        if self._manifest.get("version") != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported chunk store version: {self._manifest.get('version')}")
+
+        self._index: Optional[Dict[str, List[int]]] = None
+        self._shard_maps: Dict[int, mmap.mmap] = {}
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return (Path(store_dir) / MANIFEST_FILE).exists()
+
+    def __len__(self) -> int:
+        return self._manifest["count"]
+
+    def iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        """Отдает чанки по порядку шардов, держа в памяти одну строку"""
+        for shard in self._manifest["shards"]:
+            with open(self._store_dir / shard["file"], "rb") as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def chunk_ids(self) -> List[str]:
+        return list(self._get_index())
+
+    def get(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        location = self._get_index().get(chunk_id)
+        if location is None:
+            return None
+
+        shard_idx, _, offset, length = location
+        return json.loads(self._shard_map(shard_idx)[offset:offset + length])
+
+    def close(self) -> None:
+        for shard_map in self._shard_maps.values():
+            shard_map.close()
+        self._shard_maps.clear()
+
+    def __enter__(self) -> "ChunkStore":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _get_index(self) -> Dict[str, List[int]]:
+        if self._index is None:
+            with open(self._store_dir / INDEX_FILE, encoding="utf-8") as f:
+                self._index = json.load(f)
+        return self._index
+
+    def _shard_map(self, shard_idx: int) -> mmap.mmap:
+        shard_map = self._shard_maps.get(shard_idx)
+        if shard_map is None:
+            with open(self._store_dir / self._manifest["shards"][shard_idx]["file"], "rb") as f:
+                shard_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._shard_maps[shard_idx] = shard_map
+        return shard_map
@@ -0,0 +1,84 @@
+import time
+from enum import Enum
+
+from utils.logger import get_logger
+
+log = get_logger("CircuitBreaker")
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонен без обращения к провайдеру: цепь разомкнута"""
+
+
+class CircuitBreaker:
+    """
+    Размыкает цепь после серии сбоев провайдера и быстро отклоняет вызовы.
+
+    После recovery_timeout пропускается один пробный вызов: успех замыкает
+    цепь, сбой снова размыкает ее на recovery_timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        """
+        Args:
+            name: Имя защищаемого провайдера (для логов)
+            failure_threshold: Количество сбоев подряд до размыкания
+            recovery_timeout: Время в секундах до пробного вызова
+        """
+        self._name: str = name
+        self._failure_threshold: int = failure_threshold
+        self._recovery_timeout: float = recovery_timeout
+        self._state: CircuitState = CircuitState.CLOSED
+        self._failures: int = 0
+        self._opened_at: float = 0.0
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    def before_call(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: Если цепь разомкнута и время пробного вызова не наступило
+        """
+        if self._state == CircuitState.CLOSED:
+            return
+
+        now = time.monotonic()
+        retry_in = self._recovery_timeout - (now - self._opened_at)
+        if retry_in > 0:
+            raise CircuitOpenError(f"{self._name} is unavailable, retry in {retry_in:.1f}s")
+
+        self._state = CircuitState.HALF_OPEN
+        self._opened_at = now
+        log.info(f"{self._name}: пробный вызов после размыкания цепи")
+
+    def record_success(self) -> None:
+        if self._state != CircuitState.CLOSED:
+            log.info(f"{self._name}: цепь замкнута")
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+
+    def record_neutral(self) -> None:
+        """
+        Вызов завершился ошибкой, не говорящей о состоянии провайдера (ошибка запроса, 4xx).
+
+        Счетчик сбоев не меняется; пробный вызов не засчитывается, и следующий
+        вызов снова будет пробным.
+        """
+        if self._state == CircuitState.HALF_OPEN:
+            self._opened_at = time.monotonic() - self._recovery_timeout
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == CircuitState.HALF_OPEN or self._failures >= self._failure_threshold:
+            if self._state != CircuitState.OPEN:
+                log.warning(f"{self._name}: цепь разомкнута после {self._failures} сбоев")
+            self._state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
@@ -0,0 +1,122 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Union
+
+from utils.logger import get_logger
+
+log = get_logger("ConcurrencyLimiter")
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Очередь ожидания переполнена или слот не освободился за queue_timeout"""
+
+
+class ConcurrencyLimiter:
+    """
+    Ограничивает количество одновременных вызовов провайдера.
+
+    Ожидающие вызовы стоят в ограниченной FIFO-очереди с таймаутом.
+    В адаптивном режиме лимит меняется по AIMD: растет на 1/limit после
+    каждого успешного вызова и умножается на DECREASE_FACTOR при перегрузке.
+    """
+
+    DECREASE_FACTOR: float = 0.7
+
+    def __init__(
+        self,
+        name: str,
+        max_limit: int,
+        min_limit: int = 1,
+        max_queue: int = 100,
+        queue_timeout: float = 30.0,
+        adaptive: bool = False
+    ):
+        """
+        Args:
+            name: Имя защищаемого провайдера (для логов)
+            max_limit: Максимальное (и начальное) число одновременных вызовов
+            min_limit: Нижняя граница адаптивного лимита
+            max_queue: Максимальная длина очереди ожидания
+            queue_timeout: Максимальное время ожидания слота в секундах
+            adaptive: Подстраивать лимит по AIMD
+        """
+        self._name: str = name
+        self._max_limit: int = max_limit
+        self._min_limit: int = min(min_limit, max_limit)
+        self._max_queue: int = max_queue
+        self._queue_timeout: float = queue_timeout
+        self._adaptive: bool = adaptive
+        self._limit: float = float(max_limit)
+        self._in_flight: int = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return max(int(self._limit), 1)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queued": sum(1 for waiter in self._waiters if not waiter.done())
+        }
+
+    async def acquire(self) -> None:
+        """
+        Занимает слот, при необходимости дожидаясь его в очереди.
+
+        Raises:
+            ConcurrencyLimitExceeded: Если очередь переполнена или истек queue_timeout
+        """
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self._max_queue:
+            raise ConcurrencyLimitExceeded(f"{self._name}: wait queue is full ({self._max_queue})")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=self._queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот успели выдать одновременно с таймаутом или отменой
+                self._release_slot()
+            else:
+                waiter.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise ConcurrencyLimitExceeded(
+                    f"{self._name}: no free slot within {self._queue_timeout}s"
+                ) from e
+            raise
+
+    def release(self, overloaded: bool = False) -> None:
+        """
+        Освобождает слот.
+
+        Args:
+            overloaded: Вызов завершился признаком перегрузки провайдера (429, 5xx, таймаут)
+        """
+        if self._adaptive:
+            previous = self.limit
+            if overloaded:
+                self._limit = max(float(self._min_limit), self._limit * self.DECREASE_FACTOR)
+            else:
+                self._limit = min(float(self._max_limit), self._limit + 1 / self._limit)
+            if self.limit != previous:
+                log.info(f"{self._name}: лимит одновременных вызовов {previous} -> {self.limit}")
+
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self._in_flight -= 1
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._in_flight += 1
+            waiter.set_result(None)
@@ -0,0 +1,141 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+log = get_logger("EmbeddingCache")
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов запросов.
+
+    Ключ - хэш нормализованного текста вместе с именем модели.
+    В памяти хранится LRU ограниченного размера с опциональным TTL,
+    опционально есть дисковый уровень на SQLite, переживающий перезапуск.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int = 0, disk_path: str = ""):
+        """
+        Args:
+            max_size: Максимальное количество эмбеддингов в памяти (0 - кэш выключен)
+            ttl_seconds: Время жизни записи в секундах (0 - без ограничения)
+            disk_path: Путь к файлу SQLite для дискового уровня (пусто - без диска)
+        """
+        self._max_size: int = max_size
+        self._ttl: int = ttl_seconds
+        self._items: OrderedDict[str, Tuple[List[float], float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            log.info(f"Дисковый кэш эмбеддингов: {disk_path}")
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        normalized = " ".join(text.lower().split())
+        return hashlib.sha256(f"{model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, model_name: str, text: str, memory_only: bool = False) -> Optional[List[float]]:
+        """
+        Возвращает эмбеддинг из кэша или None.
+
+        Args:
+            model_name: Модель, которой посчитан эмбеддинг
+            text: Текст запроса
+            memory_only: Не обращаться к дисковому уровню
+        """
+        if not self.enabled:
+            return None
+
+        key = self.make_key(model_name, text)
+        now = time.time()
+
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                vector, created_at = item
+                if not self._is_expired(created_at, now):
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._items[key]
+
+            if memory_only or self._db is None:
+                if not memory_only:
+                    self.misses += 1
+                return None
+
+            row = self._db.execute("SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None or self._is_expired(row[1], now):
+                self.misses += 1
+                return None
+
+            vector = array("f", row[0]).tolist()
+            self._remember(key, vector, row[1])
+            self.disk_hits += 1
+            return vector
+
+    def put(self, model_name: str, text: str, vector: List[float]) -> None:
+        if not self.enabled:
+            return
+
+        key = self.make_key(model_name, text)
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, vector, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                    (key, array("f", vector).tobytes(), now)
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_size": self._max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+    def _remember(self, key: str, vector: List[float], created_at: float) -> None:
+        self._items[key] = (vector, created_at)
+        self._items.move_to_end(key)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self._ttl > 0 and now - created_at > self._ttl
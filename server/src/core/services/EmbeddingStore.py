@@ -0,0 +1,180 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.logger import get_logger
+
+log = get_logger("EmbeddingStore")
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.txt"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+UNSAFE_PATH_CHARS = re.compile(r"[^\w.-]+")
+
+
+class EmbeddingStore:
+    """
+    Дисковое хранилище эмбеддингов чанков, переживающее пересборки коллекции.
+
+    Для каждой пары (модель, размерность) своя директория: векторы float32
+    подряд в vectors.f32 (читаются через memmap) и хэши текстов в keys.txt,
+    строка N которого - ключ вектора N. Файлы только дописываются: сначала
+    векторы, потом ключи, под файловой блокировкой, поэтому хранилище можно
+    делить между процессами, а оборванная запись отбрасывается при следующей.
+    """
+
+    def __init__(self, store_dir: str, model_name: str, vector_size: int):
+        """
+        Args:
+            store_dir: Корневая директория хранилища
+            model_name: Модель, которой считаются эмбеддинги
+            vector_size: Размерность эмбеддингов
+        """
+        self._dir: Path = Path(store_dir) / f"{UNSAFE_PATH_CHARS.sub('_', model_name)}-{vector_size}"
+        self._vector_size: int = vector_size
+        self._row_bytes: int = vector_size * np.dtype(np.float32).itemsize
+
+        self._rows: Dict[str, int] = {}
+        self._row_count: int = 0
+        self._keys_offset: int = 0
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self._dir.mkdir(parents=True, exist_ok=True)
+        meta_path = self._dir / META_FILE
+        if not meta_path.exists():
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model_name": model_name, "vector_size": vector_size, "dtype": "float32"}, f, indent=2)
+        for name in (VECTORS_FILE, KEYS_FILE):
+            (self._dir / name).touch(exist_ok=True)
+
+        with self._lock:
+            self._load_new_keys()
+        log.info(f"Хранилище эмбеддингов {self._dir}: {self._row_count} векторов")
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return self._row_count
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Возвращает сохраненные эмбеддинги текстов, None для отсутствующих.
+
+        Args:
+            texts: Тексты чанков
+
+        Returns:
+            list: Копии векторов из хранилища или None, в порядке texts
+        """
+        keys = [self.make_key(text) for text in texts]
+
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                # Векторы могли дописать другие процессы
+                self._load_new_keys()
+
+            rows = [self._rows.get(key) for key in keys]
+            vectors = self._mapped_vectors()
+            result = [None if row is None else np.array(vectors[row]) for row in rows]
+
+            found = sum(vector is not None for vector in result)
+            self.hits += found
+            self.misses += len(result) - found
+            return result
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> int:
+        """
+        Дописывает эмбеддинги текстов, которых еще нет в хранилище.
+
+        Args:
+            texts: Тексты чанков
+            vectors: Эмбеддинги в порядке texts
+
+        Returns:
+            int: Количество дописанных векторов
+        """
+        with self._lock, self._file_lock():
+            self._load_new_keys()
+
+            new: Dict[str, Sequence[float]] = {}
+            for text, vector in zip(texts, vectors, strict=True):
+                key = self.make_key(text)
+                if key not in self._rows:
+                    new.setdefault(key, vector)
+            if not new:
+                return 0
+
+            matrix = np.asarray(list(new.values()), dtype=np.float32)
+            if matrix.shape[1] != self._vector_size:
+                raise ValueError(f"Embedding size {matrix.shape[1]} != {self._vector_size}")
+
+            # Хвосты оборванной записи отрезаются, чтобы строки ключей и векторов совпадали
+            with open(self._dir / VECTORS_FILE, "r+b") as f:
+                f.truncate(self._row_count * self._row_bytes)
+                f.seek(0, os.SEEK_END)
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self._dir / KEYS_FILE, "r+b") as f:
+                f.truncate(self._keys_offset)
+                f.seek(0, os.SEEK_END)
+                f.write("".join(f"{key}\n" for key in new).encode("ascii"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._load_new_keys()
+            return len(new)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._row_count,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._dir / LOCK_FILE, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_new_keys(self) -> None:
+        with open(self._dir / KEYS_FILE, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+
+        # Недописанная последняя строка еще не зафиксирована
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            self._rows.setdefault(line.decode("ascii"), self._row_count)
+            self._row_count += 1
+        self._keys_offset += end
+
+    def _mapped_vectors(self) -> Optional[np.memmap]:
+        if self._row_count and (self._vectors is None or len(self._vectors) < self._row_count):
+            self._vectors = np.memmap(
+                self._dir / VECTORS_FILE, dtype=np.float32, mode="r", shape=(self._row_count, self._vector_size)
+            )
+        return self._vectors
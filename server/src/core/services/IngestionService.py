@@ -0,0 +1,234 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Dict, Optional, Set
+
+from config.Config import CONFIG
+from core.document import Document
+from core.models.document_status import DocumentStatus
+from core.models.ingestion_job import IngestionJob
+from core.services.abc.BaseBroker import BaseBroker, BrokerMessage
+from core.services.AnswerCache import AnswerCache
+from core.services.brokers.in_memory_broker import InMemoryBroker
+from core.services.brokers.rabbitmq_broker import RabbitMQBroker
+from core.services.QdrantService import QdrantService
+from core.services.СhunksService import ChunkProcessor
+from utils.logger import get_logger
+
+log = get_logger("IngestionService")
+
+
+def create_broker() -> BaseBroker:
+    """Создает брокер по CONFIG.ingestion.broker: memory или rabbitmq"""
+    if CONFIG.ingestion.broker == "rabbitmq":
+        return RabbitMQBroker(
+            url=CONFIG.ingestion.rabbitmq_url,
+            queue_name=CONFIG.ingestion.queue_name,
+            prefetch_count=CONFIG.ingestion.workers
+        )
+    if CONFIG.ingestion.broker == "memory":
+        return InMemoryBroker()
+    raise ValueError(f"Unknown ingestion broker: {CONFIG.ingestion.broker}")
+
+
+class IngestionService:
+    """
+    Фоновая обработка загруженных документов через очередь задач.
+
+    submit только публикует задачу, обработку (Document.process_for_rag)
+    выполняют воркеры пула. Статус задачи проходит UPLOADED -> PROCESSING ->
+    READY/FAILED; при временной ошибке задача возвращается в UPLOADED и
+    публикуется повторно с экспоненциальной задержкой, которую выдерживает брокер.
+    """
+
+    def __init__(
+        self,
+        broker: BaseBroker,
+        chunk_processor: ChunkProcessor,
+        qdrant_service: QdrantService,
+        answer_cache: Optional[AnswerCache] = None,
+        on_update: Optional[Callable[[IngestionJob], None]] = None
+    ):
+        """
+        Args:
+            broker: Очередь задач
+            chunk_processor: Сервис для обработки чанков
+            qdrant_service: Сервис для работы с векторной БД
+            answer_cache: Кэш ответов, сбрасываемый после обработки документа
+            on_update: Вызывается при каждом изменении задачи (статус, прогресс)
+        """
+        self.workers = CONFIG.ingestion.workers
+        self.max_attempts = CONFIG.ingestion.max_attempts
+        self.retry_delay = CONFIG.ingestion.retry_delay
+
+        self._broker: BaseBroker = broker
+        self._chunk_processor: ChunkProcessor = chunk_processor
+        self._qdrant_service: QdrantService = qdrant_service
+        self._answer_cache: Optional[AnswerCache] = answer_cache
+        self._on_update: Optional[Callable[[IngestionJob], None]] = on_update
+
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingestion")
+        self._slots = asyncio.Semaphore(self.workers)
+        self._consumer: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, document: Document) -> IngestionJob:
+        """
+        Ставит документ в очередь на обработку и сразу возвращает задачу.
+
+        Args:
+            document: Загруженный документ
+
+        Returns:
+            IngestionJob: Задача в статусе UPLOADED
+        """
+        job = IngestionJob(
+            id=str(uuid.uuid4()),
+            document_id=document.id,
+            user_id=document.user_id,
+            filename=document.filename,
+            file_path=document.file_path
+        )
+        self._jobs[job.id] = job
+
+        await self._broker.publish(job.to_dict())
+        self._notify(job)
+        log.info(f"Документ {document.id} поставлен в очередь, задача {job.id}")
+
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    async def start(self) -> None:
+        """Подключается к брокеру и запускает обработку очереди"""
+        if self._consumer is not None:
+            return
+
+        await self._broker.connect()
+        self._consumer = asyncio.create_task(self._consume())
+        log.info(f"Обработка очереди запущена, воркеров: {self.workers}")
+
+    async def stop(self) -> None:
+        """Останавливает прием задач и дожидается выполняющихся"""
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        await self._broker.close()
+        self._executor.shutdown(wait=True)
+
+    async def _consume(self) -> None:
+        async for message in self._broker.consume():
+            task = asyncio.create_task(self._dispatch(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, message: BrokerMessage) -> None:
+        try:
+            job = self._resolve_job(message.body)
+        except Exception as e:
+            log.error(f"Некорректное сообщение задачи отклонено: {e}")
+            await message.reject()
+            return
+
+        async with self._slots:
+            await self._handle(job, message)
+
+    async def _handle(self, job: IngestionJob, message: BrokerMessage) -> None:
+        document = Document(
+            id=job.document_id,
+            user_id=job.user_id,
+            filename=job.filename,
+            file_path=job.file_path
+        )
+
+        job.attempts += 1
+        job.chunks_processed = 0
+        job.retry_at = None
+        self._update(job, DocumentStatus.PROCESSING)
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self._executor,
+                partial(
+                    document.process_for_rag,
+                    self._chunk_processor,
+                    self._qdrant_service,
+                    self._answer_cache,
+                    on_progress=lambda count: loop.call_soon_threadsafe(self._report_progress, job, count)
+                )
+            )
+
+            job.error = None
+            job.chunk_count = document.chunk_count
+            job.page_count = document.page_count
+            job.content_version = document.content_version
+            self._update(job, DocumentStatus.READY)
+            await message.ack()
+            log.info(f"Задача {job.id}: документ {job.document_id} обработан, чанков: {document.chunk_count}")
+
+        except ValueError as e:
+            # Документ не прошел валидацию: повтор не поможет
+            job.error = str(e)
+            self._update(job, DocumentStatus.FAILED)
+            await message.reject()
+            log.error(f"Задача {job.id}: {e}")
+
+        except Exception as e:
+            job.error = str(e)
+
+            if job.attempts >= self.max_attempts:
+                self._update(job, DocumentStatus.FAILED)
+                await message.reject()
+                log.error(f"Задача {job.id}: попытки исчерпаны ({job.attempts}): {e}")
+                return
+
+            # Повтор откладывает брокер: сообщение подтверждается сразу и не держит потребителя
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            job.retry_at = datetime.now() + timedelta(seconds=delay)
+            self._update(job, DocumentStatus.UPLOADED)
+            await self._broker.publish(job.to_dict(), delay=delay)
+            await message.ack()
+            log.warning(f"Задача {job.id}: ошибка на попытке {job.attempts}, повтор через {delay:.1f} c: {e}")
+
+    def _resolve_job(self, body: dict) -> IngestionJob:
+        incoming = IngestionJob.from_dict(body)
+        job = self._jobs.get(incoming.id)
+        if job is None:
+            # Задача опубликована другим процессом
+            self._jobs[incoming.id] = incoming
+            return incoming
+
+        job.attempts = incoming.attempts
+        job.retry_at = incoming.retry_at
+        return job
+
+    def _report_progress(self, job: IngestionJob, chunks_processed: int) -> None:
+        job.chunks_processed = chunks_processed
+        job.updated_at = datetime.now()
+        self._notify(job)
+
+    def _update(self, job: IngestionJob, status: DocumentStatus) -> None:
+        job.status = status
+        job.updated_at = datetime.now()
+        self._notify(job)
+
+    def _notify(self, job: IngestionJob) -> None:
+        if self._on_update is None:
+            return
+        try:
+            self._on_update(job)
+        except Exception as e:
+            log.error(f"Ошибка в обработчике обновления задачи {job.id}: {e}")
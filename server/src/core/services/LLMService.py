@@ -1,45 +1,299 @@
 import json
+import random
+import hashlib
 import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass, field, replace
+from typing import AsyncIterator, Dict, Optional
 
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
 
 from config.Config import CONFIG
+from core.services.CircuitBreaker import CircuitBreaker
+from core.services.ConcurrencyLimiter import ConcurrencyLimiter
 from utils.logger import get_logger
 
 log = get_logger("LLMService")
 
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+@dataclass
+class LLMUsage:
+    """Токены одного вызова LLM"""
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+@dataclass
+class LLMCompletion:
+    content: str
+    usage: LLMUsage = field(default_factory=LLMUsage)
+    coalesced: bool = False  # ответ получен из одновременного идентичного вызова
+
+
 class LLMService:
     def __init__(self):
         self.openai = AsyncOpenAI(
             api_key=CONFIG.llm.token,
-            base_url=CONFIG.llm.url
+            base_url=CONFIG.llm.url,
+            max_retries=0
         )
+        self.max_attempts = CONFIG.llm.max_attempts
+        self.backoff_base = CONFIG.llm.backoff_base
+        self.backoff_max = CONFIG.llm.backoff_max
+        self.request_deadline = CONFIG.llm.request_deadline
+        self.circuit_breaker = CircuitBreaker(
+            name="LLM",
+            failure_threshold=CONFIG.llm.circuit_failure_threshold,
+            recovery_timeout=CONFIG.llm.circuit_recovery_timeout
+        )
+        self.limiter = ConcurrencyLimiter(
+            name="LLM",
+            max_limit=CONFIG.llm.max_concurrency,
+            min_limit=CONFIG.llm.min_concurrency,
+            max_queue=CONFIG.llm.max_queue,
+            queue_timeout=CONFIG.llm.queue_timeout,
+            adaptive=CONFIG.llm.adaptive_concurrency
+        )
+        self.coalesce_requests = CONFIG.llm.coalesce_requests
+        self._in_flight_requests: Dict[str, asyncio.Future] = {}
+        self._metrics_lock = threading.Lock()
         self.request_counter = 0
-        self.total_input_token = 0
-        self.total_output_token = 0
+        self.coalesced_counter = 0
+        self._total_input_token = 0
+        self._total_output_token = 0
         log.info("LLMSservice init")
 
-    async def fetch_completion(self, prompt: str, args=None) -> str:
-        self.request_counter += 1
-        request_id = self.request_counter
+    @property
+    def total_input_token(self) -> int:
+        """Входные токены всех вызовов процесса (для метрик, не для биллинга запроса)"""
+        return self._total_input_token
+
+    @property
+    def total_output_token(self) -> int:
+        """Выходные токены всех вызовов процесса (для метрик, не для биллинга запроса)"""
+        return self._total_output_token
+
+    def get_metrics(self) -> Dict[str, int]:
+        with self._metrics_lock:
+            return {
+                "requests": self.request_counter,
+                "coalesced_requests": self.coalesced_counter,
+                "input_tokens": self._total_input_token,
+                "output_tokens": self._total_output_token,
+                **self.limiter.stats()
+            }
+
+    async def fetch_completion(self, prompt: str, args=None) -> LLMCompletion:
+        """
+        Запрос к LLM.
+
+        Временные ошибки (429, 5xx, сеть, таймаут) повторяются с экспоненциальной
+        задержкой и jitter либо через Retry-After, в пределах request_deadline.
+        Пока цепь разомкнута, вызов сразу завершается CircuitOpenError.
+
+        Одновременные вызовы с одинаковыми prompt и args объединяются в один
+        запрос к провайдеру; каждый получает копию ответа и его usage.
+
+        Returns:
+            LLMCompletion: Ответ и токены этого вызова
+        """
+        if not self.coalesce_requests:
+            return await self.__fetch_with_retries(prompt, args or {})
+
+        key = self._coalescing_key(prompt, args or {})
+        leader = self._in_flight_requests.get(key)
+        if leader is not None:
+            with self._metrics_lock:
+                self.coalesced_counter += 1
+            log.info("Запрос к llm объединен с уже выполняющимся идентичным запросом")
+            completion = await asyncio.shield(leader)
+            return replace(completion, usage=replace(completion.usage), coalesced=True)
+
+        task = asyncio.ensure_future(self.__fetch_with_retries(prompt, args or {}))
+        self._in_flight_requests[key] = task
+        task.add_done_callback(lambda done: self._forget_in_flight(key, done))
+
+        return await asyncio.shield(task)
+
+    async def __fetch_with_retries(self, prompt: str, args) -> LLMCompletion:
+        request_id = self._next_request_id()
         log.info(f"Запрос к llm ({request_id}): {prompt}")
 
-        counter = 0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_deadline
+        attempt = 0
         while True:
+            self.circuit_breaker.before_call()
+            await self.limiter.acquire()
+            overloaded = False
             try:
-                res = await self.__fetch_completion(prompt, args or {})
-                log.info(f"Ответ от llm ({request_id}): {res}")
+                res = await asyncio.wait_for(
+                    self.__fetch_completion(prompt, args),
+                    timeout=max(deadline - loop.time(), 0)
+                )
+                self.circuit_breaker.record_success()
+                log.info(f"Ответ от llm ({request_id}): {res.content}")
 
                 return res
             except Exception as e:
-                counter += 1
-                if counter < 3:
-                    pass
-                    log.warning(f"Ошибка при запросе к llm: {str(e)}")
-                else:
+                overloaded = self._is_retryable(e)
+                attempt += 1
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise e
+                log.warning(f"Ошибка при запросе к llm ({request_id}), попытка {attempt}, повтор через {delay:.2f} c: {str(e)}")
+            finally:
+                self.limiter.release(overloaded=overloaded)
+
+            await asyncio.sleep(delay)
+
+    async def stream_completion(self, prompt: str, args=None, usage: Optional[LLMUsage] = None) -> AsyncIterator[str]:
+        """
+        Потоковый запрос к LLM: отдает фрагменты ответа по мере генерации.
+
+        Повторная попытка возможна только до первого полученного фрагмента,
+        request_deadline ограничивает ожидание открытия потока и повторы.
+        Токены берутся из usage последнего чанка потока и записываются в переданный usage.
+        """
+        request_id = self._next_request_id()
+        log.info(f"Потоковый запрос к llm ({request_id}): {prompt}")
+
+        usage = usage if usage is not None else LLMUsage()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_deadline
+        attempt = 0
+        while True:
+            self.circuit_breaker.before_call()
+            await self.limiter.acquire()
+            overloaded = False
+            parts = []
+            try:
+                stream = await asyncio.wait_for(
+                    self.__open_stream(prompt, args or {}),
+                    timeout=max(deadline - loop.time(), 0)
+                )
+                async for delta in self.__read_stream(stream, usage):
+                    parts.append(delta)
+                    yield delta
+
+                self.circuit_breaker.record_success()
+                log.info(f"Ответ от llm ({request_id}): {''.join(parts)}")
+                return
+            except Exception as e:
+                overloaded = self._is_retryable(e)
+                attempt += 1
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None or parts:
                     raise e
+                log.warning(f"Ошибка при запросе к llm ({request_id}), попытка {attempt}, повтор через {delay:.2f} c: {str(e)}")
+            finally:
+                self.limiter.release(overloaded=overloaded)
 
-    async def __fetch_completion(self, prompt: str, args) -> str:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _coalescing_key(prompt: str, args) -> str:
+        payload = json.dumps({"prompt": prompt, "args": args}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _forget_in_flight(self, key: str, task: asyncio.Future) -> None:
+        if self._in_flight_requests.get(key) is task:
+            del self._in_flight_requests[key]
+        if not task.cancelled():
+            # Ошибку получают ожидающие вызовы; помечаем ее обработанной, если их не осталось
+            task.exception()
+
+    def _retry_delay(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """
+        Классифицирует ошибку и возвращает задержку перед повтором или None, если повторять нельзя.
+
+        Ошибки клиента (4xx кроме 408/409/429) и прочие неповторяемые ошибки не повторяются
+        и не считаются ни сбоем, ни успехом провайдера.
+        Retry-After провайдера соблюдается полностью; если он выходит за дедлайн, повтора нет.
+        """
+        if not self._is_retryable(error):
+            self.circuit_breaker.record_neutral()
+            return None
+
+        self.circuit_breaker.record_failure()
+        if attempt >= self.max_attempts:
+            return None
+
+        delay = self._retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+        if asyncio.get_running_loop().time() + delay >= deadline:
+            return None
+
+        return delay
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (APIConnectionError, asyncio.TimeoutError)):
+            return True
+        if isinstance(error, APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+        return False
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Читает Retry-After / retry-after-ms из ответа провайдера"""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+
+            retry_after = headers.get("retry-after")
+            if not retry_after:
+                return None
+            if retry_after.strip().isdigit():
+                return float(retry_after)
+
+            retry_at = parsedate_to_datetime(retry_after)
+            return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    async def __open_stream(self, prompt: str, args):
+        return await self.openai.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=CONFIG.llm.model,
+            temperature=0,
+            top_p=0.5,
+            stream=True,
+            stream_options={"include_usage": True},
+            **args
+        )
+
+    async def __read_stream(self, stream, usage: LLMUsage) -> AsyncIterator[str]:
+        has_usage = False
+        async for chunk in stream:
+            if chunk.usage:
+                has_usage = True
+                usage.input_tokens = int(chunk.usage.prompt_tokens)
+                usage.output_tokens = int(chunk.usage.completion_tokens)
+                self._record_usage(usage)
+
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+        if not has_usage:
+            log.warning("Нет информации")
+
+    async def __fetch_completion(self, prompt: str, args) -> LLMCompletion:
         res = await self.openai.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model=CONFIG.llm.model,
@@ -49,19 +303,32 @@ class LLMService:
             **args
         )
 
+        usage = LLMUsage()
         if res.usage:
-            self.total_input_token += int(res.usage.prompt_tokens)
-            self.total_output_token += int(res.usage.completion_tokens)
+            usage.input_tokens = int(res.usage.prompt_tokens)
+            usage.output_tokens = int(res.usage.completion_tokens)
+            self._record_usage(usage)
         else:
             log.warning("Нет информации")
             pass
 
-        return str(res.choices[0].message.content)
+        return LLMCompletion(content=str(res.choices[0].message.content), usage=usage)
+
+    def _next_request_id(self) -> int:
+        with self._metrics_lock:
+            self.request_counter += 1
+            return self.request_counter
+
+    def _record_usage(self, usage: LLMUsage) -> None:
+        with self._metrics_lock:
+            self._total_input_token += usage.input_tokens
+            self._total_output_token += usage.output_tokens
 
 async def main():
     service = LLMService()
     prompt = ("Как ты брат?")
-    await service.fetch_completion(prompt)
+    completion = await service.fetch_completion(prompt)
+    print(completion.content, completion.usage)
 
 if __name__ == "__main__":
-     asyncio.run(main())
\ No newline at end of file
+     asyncio.run(main())
@@ -0,0 +1,112 @@
+import asyncio
+from typing import Any, Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar
+
+from core.services.inference_executor import run_inference
+from utils.logger import get_logger
+
+log = get_logger("MicroBatcher")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Собирает одиночные вызовы модели из конкурентных корутин в пачки.
+
+    Пачка уходит в пул инференса одним вызовом process_batch, когда в ней
+    набралось max_batch_size единиц (item_size каждого элемента) или прошло
+    max_wait_ms с первого элемента пачки. Пока пачка считается, следующие
+    запросы собираются в новую, так что задержка ограничена max_wait_ms
+    плюс время одного вызова модели.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process_batch: Callable[[List[T]], List[R]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        item_size: Optional[Callable[[T], int]] = None
+    ):
+        """
+        Args:
+            name: Имя для логов и статистики
+            process_batch: Блокирующая функция: список элементов -> результаты в том же порядке
+            max_batch_size: Размер пачки, при котором она отправляется не дожидаясь таймаута
+            max_wait_ms: Максимальное ожидание первого элемента пачки, мс
+            item_size: Вес элемента в пачке, по умолчанию 1
+        """
+        self.name: str = name
+        self._process_batch = process_batch
+        self._max_batch_size: int = max(1, max_batch_size)
+        self._max_wait: float = max(0.0, max_wait_ms) / 1000
+        self._item_size: Callable[[T], int] = item_size or (lambda item: 1)
+
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._pending_size: int = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.batches: int = 0
+        self.items: int = 0
+
+    async def submit(self, item: T) -> R:
+        """
+        Добавляет элемент в текущую пачку и ждет его результата.
+
+        Raises:
+            Exception: Ошибка process_batch пробрасывается всем элементам пачки
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        self._pending_size += self._item_size(item)
+
+        if self._pending_size >= self._max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait, self._flush)
+
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = [(item, future) for item, future in self._pending if not future.done()]
+        self._pending = []
+        self._pending_size = 0
+        if not batch:
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        try:
+            results = await run_inference(self._process_batch, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name}: process_batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            log.error(f"Ошибка пачки {self.name} из {len(batch)} элементов: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results, strict=True):
+            if not future.done():
+                future.set_result(result)
@@ -1,69 +1,608 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Set, Tuple, Union
+from dataclasses import dataclass
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
+import hashlib
 import uuid
+import re
 import asyncio
 import json
+import threading
+import time
+import weakref
 
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+import numpy as np
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PointIdsList, PayloadSchemaType, QueryRequest,
+    Filter, FieldCondition, MatchValue, IsEmptyCondition, PayloadField,
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+    HnswConfigDiff, SearchParams, QuantizationSearchParams, VectorParamsDiff, CollectionParamsDiff,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, BinaryQuantization, BinaryQuantizationConfig, Disabled,
+    SparseVectorParams, Modifier, Prefetch, FusionQuery, Fusion
+)
 from sentence_transformers import SentenceTransformer
 
+from core.services.ChunkStore import ChunkStore
+from core.services.EmbeddingCache import EmbeddingCache
+from core.services.EmbeddingStore import EmbeddingStore
+from core.services.MicroBatcher import MicroBatcher
+from core.services.SparseEncoder import BM25SparseEncoder
+from core.services.model_registry import get_sentence_transformer, model_id
+from core.services.inference_executor import run_inference
 from utils.logger import get_logger
 from config.Config import CONFIG
 
 log = get_logger("QdrantService")
 
+INDEXED_PAYLOAD_FIELDS = {
+    "document_id": PayloadSchemaType.INTEGER,
+    "user_id": PayloadSchemaType.INTEGER,
+    "scope": PayloadSchemaType.KEYWORD,
+}
+SORT_WINDOW_BATCHES = 8
+SCROLL_PAGE_SIZE = 1000
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "gigaschool/qdrant/chunks")
+KB_SCOPE = "kb"
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+SPARSE_VECTOR_NAME = "bm25"
+# Алиас на теневую коллекцию на время пересборки: запись через алиас дублируется в нее
+REBUILD_ALIAS_SUFFIX = "_rebuild"
+CATCH_UP_ROUNDS = 5
+
+
+_clients: Dict[Tuple[str, int], QdrantClient] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, int], AsyncQdrantClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+_clients_lock = threading.Lock()
+
+
+def get_qdrant_client(host: str, port: int) -> QdrantClient:
+    """Общий для процесса синхронный клиент Qdrant для host:port"""
+    with _clients_lock:
+        client = _clients.get((host, port))
+        if client is None:
+            client = QdrantClient(host=host, port=port, timeout=60)
+            _clients[(host, port)] = client
+            log.info(f"Подключение к Qdrant установлено: {host}:{port}")
+        return client
+
+
+def get_async_qdrant_client(host: str, port: int) -> AsyncQdrantClient:
+    """
+    Асинхронный клиент Qdrant для host:port, общий в пределах текущего event loop.
+
+    Соединения асинхронного клиента привязаны к loop, в котором открыты,
+    поэтому каждый loop (например, asyncio.run в скрипте или тестах) получает свой клиент.
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get((host, port))
+        if client is None:
+            client = AsyncQdrantClient(host=host, port=port, timeout=60)
+            loop_clients[(host, port)] = client
+        return client
+
+
+@dataclass
+class SearchQuery:
+    query: str
+    document_id: Optional[int] = None
+    user_id: Optional[int] = None
+    limit: Optional[int] = None  # по умолчанию top_samples
+
 class QdrantService:
     def __init__(self):
         self.host = CONFIG.qdrant.host
         self.port = CONFIG.qdrant.port
         self.collection_name = CONFIG.qdrant.collection_name
         self.model_name = CONFIG.qdrant.model_name
+        self.backend = CONFIG.qdrant.backend
+        # Имя модели в ключах кэша и хранилища эмбеддингов
+        self.embedding_model_id = model_id(self.model_name, self.backend)
         self.vector_size = CONFIG.qdrant.vector_size
         self.top_samples = CONFIG.qdrant.top_samples
         self.batch_size = CONFIG.qdrant.batch_size
+        self.encode_batch_size = CONFIG.qdrant.encode_batch_size
+        self.keep_previous_versions = CONFIG.qdrant.keep_previous_versions
+        self.quantization = CONFIG.qdrant.quantization
+        self.quantization_always_ram = CONFIG.qdrant.quantization_always_ram
+        self.rescore = CONFIG.qdrant.rescore
+        self.oversampling = CONFIG.qdrant.oversampling
+        self.on_disk_vectors = CONFIG.qdrant.on_disk_vectors
+        self.on_disk_payload = CONFIG.qdrant.on_disk_payload
+        self.hnsw_m = CONFIG.qdrant.hnsw_m
+        self.hnsw_ef_construct = CONFIG.qdrant.hnsw_ef_construct
+        self.hnsw_ef = CONFIG.qdrant.hnsw_ef
+        self.hybrid_search = CONFIG.qdrant.hybrid_search
+        self.hybrid_prefetch_limit = CONFIG.qdrant.hybrid_prefetch_limit
+        self.hybrid_check_interval = CONFIG.qdrant.hybrid_check_interval
+        self.sparse_encoder = BM25SparseEncoder(
+            k1=CONFIG.qdrant.bm25_k1,
+            b=CONFIG.qdrant.bm25_b,
+            avg_doc_length=CONFIG.qdrant.bm25_avg_doc_length
+        )
+        # В коллекции за алиасом есть разреженный вектор и гибридный поиск включен;
+        # алиас может переключить другой процесс, поэтому флаг периодически перепроверяется
+        self._hybrid_ready = False
+        self._hybrid_checked_at = 0.0
+
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown qdrant.quantization: {self.quantization}, expected one of {QUANTIZATION_MODES}")
+        self.embedding_cache = EmbeddingCache(
+            max_size=CONFIG.qdrant.embedding_cache_size,
+            ttl_seconds=CONFIG.qdrant.embedding_cache_ttl,
+            disk_path=CONFIG.qdrant.embedding_cache_path
+        )
+        # Одиночные запросы конкурентных корутин кодируются общими пачками
+        self.query_batcher: Optional[MicroBatcher[str, List[float]]] = None
+        if CONFIG.inference.micro_batch_enabled:
+            self.query_batcher = MicroBatcher(
+                "query_encode",
+                self._encode_queries,
+                max_batch_size=CONFIG.inference.query_batch_max_size,
+                max_wait_ms=CONFIG.inference.micro_batch_max_wait_ms
+            )
+        self.embedding_store: Optional[EmbeddingStore] = None
+        if CONFIG.qdrant.embedding_store_dir:
+            self.embedding_store = EmbeddingStore(
+                CONFIG.qdrant.embedding_store_dir, self.embedding_model_id, self.vector_size
+            )
 
         try:
-            self.client = QdrantClient(host=self.host, port=self.port, timeout=60)
-            log.info(f"Подключение к Qdrant установлено: {self.host}:{self.port}")
+            self.client = get_qdrant_client(self.host, self.port)
         except Exception as e:
             log.error(f"Ошибка подключения к Qdrant: {e}")
             raise
 
+        self._ensure_collection_exists()
+
+    @property
+    def async_client(self) -> AsyncQdrantClient:
+        """Асинхронный клиент текущего event loop; обращаться только из корутин"""
+        return get_async_qdrant_client(self.host, self.port)
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """Модель эмбеддингов из общего реестра, загружается при первом обращении"""
+        return get_sentence_transformer(self.model_name, self.backend)
+
+    def _ensure_collection_exists(self) -> None:
+        """
+        Проверяет, что collection_name доступно для чтения и записи.
+
+        collection_name - алиас на версионированную коллекцию {collection_name}_v{N}.
+        Коллекция, созданная до перехода на алиасы, используется как есть
+        до первой пересборки.
+        """
         try:
-            self.model = SentenceTransformer(self.model_name)
-            log.info(f"Модель {self.model_name} загружена успешно")
+            current = self._resolve_alias()
+
+            if current is not None:
+                log.info(f"Алиас '{self.collection_name}' указывает на коллекцию '{current}'")
+            elif self.collection_name in self._collection_names():
+                current = self.collection_name
+                log.info(f"Коллекция '{self.collection_name}' уже существует")
+            else:
+                current = self._versioned_name(self._next_version())
+                self._create_collection(current)
+                self._switch_alias(current, replace_collection=False)
+
+            self._ensure_payload_indexes(current)
+            self._check_storage_config(current)
+            self._set_hybrid_ready(self._supports_sparse(current))
+
+            if self.hybrid_search and not self._hybrid_ready:
+                log.warning(
+                    f"Гибридный поиск включен, но в коллекции '{current}' нет вектора '{SPARSE_VECTOR_NAME}': "
+                    f"поиск остается векторным до rebuild_collection()"
+                )
+
         except Exception as e:
-            log.error(f"Ошибка загрузки модели {self.model_name}: {e}")
+            log.error(f"Ошибка при создании коллекции: {e}")
             raise
 
-        self._ensure_collection_exists()
+    def _create_collection(self, collection_name: str) -> None:
+        self.client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(
+                size=self.vector_size,
+                distance=Distance.COSINE,
+                on_disk=self.on_disk_vectors
+            ),
+            sparse_vectors_config=(
+                {SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)} if self.hybrid_search else None
+            ),
+            hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+            quantization_config=self._quantization_config(),
+            on_disk_payload=self.on_disk_payload
+        )
+        log.info(
+            f"Коллекция '{collection_name}' создана: гибридный поиск {self.hybrid_search}, квантизация {self.quantization}, "
+            f"векторы на диске {self.on_disk_vectors}, payload на диске {self.on_disk_payload}, "
+            f"hnsw m={self.hnsw_m} ef_construct={self.hnsw_ef_construct}"
+        )
 
-    def _ensure_collection_exists(self) -> None:
+    def _supports_sparse(self, collection_name: str) -> bool:
+        if not self.hybrid_search:
+            return False
+        sparse_vectors = self.client.get_collection(collection_name).config.params.sparse_vectors or {}
+        return SPARSE_VECTOR_NAME in sparse_vectors
+
+    def _set_hybrid_ready(self, ready: bool) -> None:
+        if ready != self._hybrid_ready:
+            log.info(f"Гибридный поиск по '{self.collection_name}': {'включен' if ready else 'выключен'}")
+        self._hybrid_ready = ready
+        self._hybrid_checked_at = time.monotonic()
+
+    def _hybrid_check_due(self) -> bool:
+        return self.hybrid_search and time.monotonic() - self._hybrid_checked_at >= self.hybrid_check_interval
+
+    def _refresh_hybrid_ready(self) -> None:
+        """Перечитывает, есть ли разреженный вектор в коллекции, на которую сейчас указывает алиас"""
+        if self.hybrid_search:
+            self._set_hybrid_ready(self._supports_sparse(self._resolve_alias() or self.collection_name))
+
+    async def _refresh_hybrid_ready_async(self) -> None:
+        if not self.hybrid_search:
+            return
+        aliases = (await self.async_client.get_aliases()).aliases
+        target = next(
+            (alias.collection_name for alias in aliases if alias.alias_name == self.collection_name),
+            self.collection_name
+        )
+        sparse_vectors = (await self.async_client.get_collection(target)).config.params.sparse_vectors or {}
+        self._set_hybrid_ready(SPARSE_VECTOR_NAME in sparse_vectors)
+
+    def _quantization_config(self) -> Optional[Union[ScalarQuantization, BinaryQuantization]]:
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=self.quantization_always_ram
+            ))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        return None
+
+    def _search_params(self) -> Optional[SearchParams]:
+        """Параметры поиска из конфига: hnsw_ef и пересчет оценок по исходным векторам при квантизации"""
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+
+        if not self.hnsw_ef and quantization is None:
+            return None
+        return SearchParams(hnsw_ef=self.hnsw_ef or None, quantization=quantization)
+
+    def _check_storage_config(self, collection_name: str) -> None:
+        """Предупреждает, если коллекция создана с другими настройками хранения, чем в конфиге"""
+        config = self.client.get_collection(collection_name).config
+        quantization = config.quantization_config
+        actual_mode = (
+            "scalar" if isinstance(quantization, ScalarQuantization)
+            else "binary" if isinstance(quantization, BinaryQuantization)
+            else "none" if quantization is None
+            else type(quantization).__name__
+        )
+
+        differences = []
+        if actual_mode != self.quantization:
+            differences.append(f"квантизация {actual_mode} != {self.quantization}")
+        if isinstance(config.params.vectors, VectorParams) and bool(config.params.vectors.on_disk) != self.on_disk_vectors:
+            differences.append(f"векторы на диске {bool(config.params.vectors.on_disk)} != {self.on_disk_vectors}")
+        if bool(config.params.on_disk_payload) != self.on_disk_payload:
+            differences.append(f"payload на диске {bool(config.params.on_disk_payload)} != {self.on_disk_payload}")
+        if (config.hnsw_config.m, config.hnsw_config.ef_construct) != (self.hnsw_m, self.hnsw_ef_construct):
+            differences.append(
+                f"hnsw ({config.hnsw_config.m}, {config.hnsw_config.ef_construct}) != ({self.hnsw_m}, {self.hnsw_ef_construct})"
+            )
+
+        if differences:
+            log.warning(
+                f"Настройки коллекции '{collection_name}' отличаются от конфига: {'; '.join(differences)}. "
+                f"Примените их через migrate_storage_config() или rebuild_collection()"
+            )
+
+    def migrate_storage_config(self) -> None:
+        """
+        Применяет настройки квантизации, хранения и HNSW из конфига к текущей коллекции.
+
+        Qdrant перестраивает сегменты в фоне, поиск продолжает работать; пока
+        оптимизация не закончена, статус коллекции - yellow. Если во время
+        перестройки не хватает памяти или диска, используйте rebuild_collection():
+        новая версия сразу создается с настройками из конфига.
+        Разреженный вектор для hybrid_search так не добавляется - только через rebuild_collection().
+        """
+        current = self._resolve_alias() or self.collection_name
+
+        self.client.update_collection(
+            collection_name=current,
+            vectors_config={"": VectorParamsDiff(on_disk=self.on_disk_vectors)},
+            hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+            quantization_config=self._quantization_config() or Disabled.DISABLED,
+            collection_params=CollectionParamsDiff(on_disk_payload=self.on_disk_payload)
+        )
+        log.info(f"Настройки хранения коллекции '{current}' обновлены, идет фоновая оптимизация")
+
+    def _ensure_payload_indexes(self, collection_name: str) -> None:
+        collection_info = self.client.get_collection(collection_name)
+        existing_indexes = collection_info.payload_schema or {}
+
+        for field_name, field_schema in INDEXED_PAYLOAD_FIELDS.items():
+            if field_name in existing_indexes:
+                continue
+
+            self.client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+                wait=True
+            )
+            log.info(f"Создан payload-индекс '{field_name}' в коллекции '{collection_name}'")
+
+    def _collection_names(self) -> List[str]:
+        return [col.name for col in self.client.get_collections().collections]
+
+    def _resolve_alias(self, alias_name: Optional[str] = None) -> Optional[str]:
+        """Возвращает коллекцию, на которую указывает алиас (по умолчанию collection_name), или None"""
+        alias_name = alias_name or self.collection_name
+        for alias in self.client.get_aliases().aliases:
+            if alias.alias_name == alias_name:
+                return alias.collection_name
+        return None
+
+    @property
+    def _rebuild_alias(self) -> str:
+        return f"{self.collection_name}{REBUILD_ALIAS_SUFFIX}"
+
+    def _write_targets(self, collection_name: Optional[str]) -> List[str]:
+        """
+        Коллекции для записи: явно заданная или алиас collection_name,
+        плюс теневая коллекция, если идет пересборка (в том числе в другом процессе).
+        """
+        if collection_name:
+            return [collection_name]
+
+        shadow = self._resolve_alias(self._rebuild_alias)
+        return [self.collection_name] if shadow is None else [self.collection_name, shadow]
+
+    def _versioned_name(self, version: int) -> str:
+        return f"{self.collection_name}_v{version}"
+
+    def _versions(self) -> List[int]:
+        """Версии коллекций {collection_name}_v{N}, существующие в Qdrant, по возрастанию"""
+        pattern = re.compile(rf"^{re.escape(self.collection_name)}_v(\d+)$")
+        matches = (pattern.match(name) for name in self._collection_names())
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def _next_version(self) -> int:
+        versions = self._versions()
+        return versions[-1] + 1 if versions else 1
+
+    def _switch_alias(self, target: str, replace_collection: bool) -> None:
+        """
+        Атомарно переключает алиас collection_name на коллекцию target.
+
+        Args:
+            target: Коллекция, на которую должен указывать алиас
+            replace_collection: На месте алиаса сейчас коллекция без алиасов,
+                ее нужно удалить перед созданием алиаса
+        """
+        operations = []
+        if replace_collection:
+            # Алиас не может совпадать с именем коллекции: старую коллекцию
+            # приходится удалить, переключение в этом случае не атомарно
+            self.client.delete_collection(collection_name=self.collection_name)
+            log.info(f"Коллекция '{self.collection_name}' без алиаса удалена")
+        elif self._resolve_alias() is not None:
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self.collection_name)))
+
+        operations.append(CreateAliasOperation(
+            create_alias=CreateAlias(collection_name=target, alias_name=self.collection_name)
+        ))
+        if self._resolve_alias(self._rebuild_alias) is not None:
+            # Пересборка закончена: дублирование записи снимается в той же операции
+            operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=self._rebuild_alias)))
+        self.client.update_collection_aliases(change_aliases_operations=operations)
+        self._set_hybrid_ready(self._supports_sparse(target))
+        log.info(f"Алиас '{self.collection_name}' переключен на коллекцию '{target}'")
+
+    def rebuild_collection(self, chunks_dir: Optional[str] = None) -> str:
+        """
+        Пересобирает индекс в новой версии коллекции без остановки поиска.
+
+        Точки пишутся в теневую коллекцию {collection_name}_v{N+1} текущей
+        моделью и с текущим vector_size; поиск в это время идет по старой версии.
+        После проверки количества точек алиас атомарно переключается на новую
+        версию, а предыдущие keep_previous_versions версий остаются для отката.
+
+        Чанки документов перекодируются из текста в payload текущей версии.
+        Пока идет пересборка, алиас {collection_name}_rebuild указывает на
+        теневую коллекцию, и запись через collection_name дублируется в нее;
+        изменения, сделанные до этого, догоняются сверкой id перед переключением.
+
+        Args:
+            chunks_dir: Директория с чанками базы знаний; без нее база знаний
+                тоже перекодируется из текущей версии
+
+        Returns:
+            str: Имя новой коллекции
+
+        Raises:
+            ValueError: Если в новой коллекции не совпало количество точек
+                или точки не удалось догнать за CATCH_UP_ROUNDS сверок
+        """
+        current = self._resolve_alias()
+        source = current or self.collection_name
+        shadow = self._versioned_name(self._next_version())
+        if self._resolve_alias(self._rebuild_alias) is not None:
+            raise ValueError(
+                f"Collection '{self.collection_name}' is already being rebuilt; "
+                f"if no rebuild is running, delete alias '{self._rebuild_alias}'"
+            )
+
+        self._create_collection(shadow)
         try:
-            collections = self.client.get_collections()
-            collection_names = [col.name for col in collections.collections]
-
-            if self.collection_name not in collection_names:
-                self.client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=self.vector_size,
-                        distance=Distance.COSINE
-                    )
-                )
-                log.info(f"Коллекция '{self.collection_name}' создана")
+            self._ensure_payload_indexes(shadow)
+            self.client.update_collection_aliases(change_aliases_operations=[CreateAliasOperation(
+                create_alias=CreateAlias(collection_name=shadow, alias_name=self._rebuild_alias)
+            )])
+
+            if chunks_dir is not None:
+                with self._kb_items(chunks_dir) as items:
+                    kb_count = self._sync_points(KB_SCOPE, items, None, collection_name=shadow)
+                if not kb_count:
+                    raise ValueError(f"No knowledge base chunks found in {chunks_dir}")
+                copy_filter = Filter(must_not=[self._kb_filter()])
             else:
-                log.info(f"Коллекция '{self.collection_name}' уже существует")
+                kb_count = 0
+                copy_filter = None
+
+            # Точки без текста перекодировать не из чего, они не переносятся
+            without_text: Set[str] = set()
+            self._encode_and_upsert(self._iter_points(source, copy_filter, without_text=without_text), collection_name=shadow)
+
+            copied = self._catch_up(source, shadow, copy_filter, without_text)
+
+            if without_text:
+                log.warning(f"Пропущено точек без текста: {len(without_text)}, в '{shadow}' они не перенесены")
+
+            # Точки документов сверены по id, и запись в них уже дублируется в обе коллекции,
+            # поэтому их количество может расти; по количеству проверяется база знаний
+            actual = self.client.count(collection_name=shadow, exact=True).count
+            if copy_filter is not None:
+                kb_actual = actual - self.client.count(collection_name=shadow, count_filter=copy_filter, exact=True).count
+                if kb_actual != kb_count:
+                    raise ValueError(f"Collection '{shadow}' has {kb_actual} knowledge base points, expected {kb_count}")
+            log.info(f"В '{shadow}' перенесено {copied} точек, всего точек: {actual}")
 
         except Exception as e:
-            log.error(f"Ошибка при создании коллекции: {e}")
+            # Вместе с коллекцией удаляется и алиас пересборки
+            log.error(f"Пересборка коллекции '{shadow}' не удалась, коллекция удаляется: {e}")
+            self.client.delete_collection(collection_name=shadow)
             raise
 
+        self._switch_alias(shadow, replace_collection=current is None)
+        self._drop_old_versions()
+
+        log.info(f"Коллекция пересобрана: '{source}' -> '{shadow}', точек: {actual}")
+        return shadow
+
+    def _catch_up(self, source: str, shadow: str, copy_filter: Optional[Filter], without_text: Set[str]) -> int:
+        """
+        Догоняет в теневой коллекции изменения, сделанные в source до начала
+        дублирования записи, и повторяет сверку, пока id не совпадут.
+
+        Returns:
+            int: Количество перенесенных точек (без базы знаний при copy_filter)
+
+        Raises:
+            ValueError: Если id не совпали за CATCH_UP_ROUNDS сверок
+        """
+        for _ in range(CATCH_UP_ROUNDS):
+            source_ids = self._scroll_point_ids(copy_filter, collection_name=source)
+            shadow_ids = self._scroll_point_ids(copy_filter, collection_name=shadow)
+            missing = source_ids - without_text - shadow_ids
+            stale = shadow_ids - source_ids
+            if not missing and not stale:
+                return len(shadow_ids)
+
+            log.info(f"Догоняем '{shadow}': недостает {len(missing)}, лишних {len(stale)}")
+            self._encode_and_upsert(
+                self._iter_points(source, copy_filter, skip_ids=shadow_ids, without_text=without_text),
+                collection_name=shadow
+            )
+            self._delete_points(list(stale), collection_name=shadow)
+
+        raise ValueError(f"Collection '{shadow}' did not catch up with '{source}' in {CATCH_UP_ROUNDS} rounds")
+
+    def rollback_collection(self) -> str:
+        """
+        Переключает алиас на предыдущую сохраненную версию коллекции.
+
+        Returns:
+            str: Имя коллекции, на которую переключен алиас
+
+        Raises:
+            ValueError: Если предыдущей версии нет
+        """
+        current = self._resolve_alias()
+        if current is None:
+            raise ValueError(f"'{self.collection_name}' is not an alias, nothing to roll back")
+
+        current_version = int(current.rsplit("_v", 1)[1])
+        previous = [version for version in self._versions() if version < current_version]
+        if not previous:
+            raise ValueError(f"No previous version of '{self.collection_name}' to roll back to")
+
+        target = self._versioned_name(previous[-1])
+        self._switch_alias(target, replace_collection=False)
+        return target
+
+    def _drop_old_versions(self) -> None:
+        current = self._resolve_alias()
+        versions = self._versions()
+        current_version = int(current.rsplit("_v", 1)[1])
+
+        older = [version for version in versions if version < current_version]
+        stale = older[:max(len(older) - self.keep_previous_versions, 0)]
+
+        for version in stale:
+            self.client.delete_collection(collection_name=self._versioned_name(version))
+            log.info(f"Удалена устаревшая версия коллекции '{self._versioned_name(version)}'")
+
+    def _iter_points(
+        self,
+        collection_name: str,
+        scroll_filter: Optional[Filter],
+        skip_ids: Optional[Set[str]] = None,
+        without_text: Optional[Set[str]] = None
+    ) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Отдает точки коллекции тройками (id точки, текст, payload) для перекодирования.
+
+        Args:
+            collection_name: Коллекция-источник
+            scroll_filter: Фильтр точек
+            skip_ids: Точки, которые не нужно отдавать
+            without_text: Сюда добавляются id пропущенных точек без текста
+        """
+        offset = None
+
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False
+            )
+            for point in points:
+                point_id = str(point.id)
+                if skip_ids is not None and point_id in skip_ids:
+                    continue
+
+                content = point.payload.get("text", "")
+                if not content:
+                    if without_text is not None:
+                        without_text.add(point_id)
+                    continue
+
+                yield point_id, content, point.payload
+
+            if offset is None:
+                return
+
     def clear_all_chunks(self):
         try:
-            self.client.delete_collection(collection_name=self.collection_name)
-            log.info(f"Коллекция '{self.collection_name}' удалена")
+            current = self._resolve_alias() or self.collection_name
+            self.client.delete_collection(collection_name=current)
+            log.info(f"Коллекция '{current}' удалена")
 
             self._ensure_collection_exists()
 
@@ -73,123 +612,406 @@ class QdrantService:
             log.error(f"Ошибка при очистке чанков: {e}")
 
     def add_vectorized_chunks(self, chunks_dir):
+        """
+        Инкрементально индексирует чанки базы знаний из директории.
+
+        Кодируются и загружаются только новые и измененные чанки,
+        точки базы знаний, которых больше нет в директории, удаляются.
+
+        Args:
+            chunks_dir: Хранилище чанков (ChunkStore) или директория с json-файлами чанков
+        """
         try:
-            chunks_path = Path(chunks_dir)
-            if not chunks_path.exists():
-                log.error(f"Директория {chunks_dir} не существует")
+            with self._kb_items(chunks_dir) as items:
+                total_indexed = self._sync_points(KB_SCOPE, items, self._kb_filter())
 
-            chunk_files = list(chunks_path.glob("*.json"))
+            if not total_indexed:
+                log.error("Не удалось обработать ни одного чанка базы знаний")
+                return
 
-            if not chunk_files:
-                log.warning(f"Не найдено файлов чанков в директории {chunks_dir}")
+            log.info(f"В Qdrant проиндексировано {total_indexed} чанков базы знаний")
 
-            log.info(f"Найдено {len(chunk_files)} файлов чанков")
+        except Exception as e:
+            log.error(f"Ошибка при добавлении чанков: {e}")
 
-            points = []
+    @staticmethod
+    def _kb_filter() -> Filter:
+        """
+        Фильтр точек базы знаний.
 
-            for chunk_file in chunk_files:
-                try:
-                    with open(chunk_file, 'r', encoding='utf-8') as f:
-                        chunk_data = json.load(f)
+        Точки базы знаний помечены scope=kb; точки, загруженные до появления
+        метки, узнаются по отсутствию document_id и имени файла чанка
+        (у чанков, загруженных вручную, filename=manual).
+        """
+        legacy_kb = Filter(
+            must=[
+                IsEmptyCondition(is_empty=PayloadField(key="scope")),
+                IsEmptyCondition(is_empty=PayloadField(key="document_id"))
+            ],
+            must_not=[FieldCondition(key="filename", match=MatchValue(value="manual"))]
+        )
+        return Filter(should=[FieldCondition(key="scope", match=MatchValue(value=KB_SCOPE)), legacy_kb])
 
-                    content = chunk_data.get("content", "")
+    @contextmanager
+    def _kb_items(self, chunks_dir: str) -> Iterator[Iterator[Tuple[str, str, Dict[str, Any]]]]:
+        """
+        Открывает чанки базы знаний для синхронизации.
 
-                    if not content:
-                        log.warning(f"Файл {chunk_file.name} имеет пустой content, пропускаем")
-                        continue
+        Хранилище чанков читается потоково, директория в старом формате
+        (json-файл на чанк) - по файлам.
 
-                    embedding = self.model.encode(content).tolist()
+        Yields:
+            Iterator: Тройки для _sync_points
+        """
+        if not ChunkStore.exists(chunks_dir):
+            yield self._iter_kb_items(self._read_kb_files(chunks_dir))
+            return
 
-                    point = PointStruct(
-                        id=str(uuid.uuid4()),
-                        vector=embedding,
-                        payload={
-                            "text": content,
-                            "url": chunk_data.get("url", ""),
-                            "title": chunk_data.get("title", ""),
-                            "parsed_at": chunk_data.get("parsed_at", ""),
-                            "filename": chunk_file.name,
-                            "chunk_id": chunk_file.stem
-                        }
-                    )
+        with ChunkStore(chunks_dir) as store:
+            log.info(f"Хранилище чанков {chunks_dir}: {len(store)} чанков")
+            yield self._iter_kb_items((chunk["chunk_id"], chunk) for chunk in store.iter_chunks())
 
-                    points.append(point)
+    @staticmethod
+    def _read_kb_files(chunks_dir: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        chunks_path = Path(chunks_dir)
+        if not chunks_path.exists():
+            log.error(f"Директория {chunks_dir} не существует")
 
-                except Exception as e:
-                    log.error(f"Ошибка при обработке файла {chunk_file}: {e}")
-                    continue
+        chunk_files = list(chunks_path.glob("*.json"))
 
-            if not points:
-                log.error("Не удалось обработать ни одного файла чанков")
-                return
+        if not chunk_files:
+            log.warning(f"Не найдено файлов чанков в директории {chunks_dir}")
 
-            total_uploaded = 0
+        log.info(f"Найдено {len(chunk_files)} файлов чанков")
 
-            for i in range(0, len(points), self.batch_size):
-                batch = points[i:i + self.batch_size]
-                self.client.upsert(
-                    collection_name=self.collection_name,
-                    points=batch,
-                    wait=True
-                )
-                total_uploaded += len(batch)
-                log.info(f"Загружено {total_uploaded}/{len(points)} чанков")
+        for chunk_file in chunk_files:
+            try:
+                with open(chunk_file, 'r', encoding='utf-8') as f:
+                    chunk_data = json.load(f)
+            except Exception as e:
+                log.error(f"Ошибка при обработке файла {chunk_file}: {e}")
+                continue
+
+            yield chunk_file.stem, chunk_data
+
+    @classmethod
+    def _iter_kb_items(
+        cls,
+        chunks: Iterable[Tuple[str, Dict[str, Any]]]
+    ) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        for chunk_id, chunk_data in chunks:
+            content = chunk_data.get("content", "")
+
+            if not content:
+                log.warning(f"Чанк {chunk_id} имеет пустой content, пропускаем")
+                continue
+
+            yield cls._make_item(KB_SCOPE, content, {
+                "text": content,
+                "url": chunk_data.get("url", ""),
+                "title": chunk_data.get("title", ""),
+                "parsed_at": chunk_data.get("parsed_at", ""),
+                "filename": f"{chunk_id}.json",
+                "chunk_id": chunk_id,
+                "scope": KB_SCOPE
+            })
+
+    def add_chunks_directly(
+        self,
+        chunks: Iterable[Dict[str, str]],
+        document_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        on_progress: Optional[Callable[[int], None]] = None
+    ) -> int:
+        """
+        Загружает чанки документа в Qdrant.
+
+        Чанки могут приходить генератором: они кодируются и загружаются
+        по мере поступления, не дожидаясь конца документа.
+
+        Id точек детерминированы содержимым, поэтому повторная загрузка не
+        создает дублей: уже проиндексированные чанки пропускаются, а при
+        указанном document_id исчезнувшие чанки документа удаляются.
+
+        Args:
+            chunks: Чанки с полями text, title, url
+            document_id: Документ, к которому относятся чанки
+            user_id: Владелец документа
+            on_progress: Вызывается с количеством загруженных чанков после каждой пачки
+
+        Returns:
+            int: Количество чанков документа в Qdrant (новых и уже проиндексированных)
+        """
+        try:
+            scope = f"document:{document_id}" if document_id is not None else "manual"
+            total_indexed = self._sync_points(
+                scope,
+                self._iter_chunk_items(scope, chunks, document_id, user_id),
+                self.build_filter(document_id=document_id) if document_id is not None else None,
+                on_progress=on_progress
+            )
+
+            if not total_indexed:
+                log.error("Не удалось обработать ни одного чанка")
+                return 0
 
-            log.info(f"Успешно добавлено {len(points)} чанков в Qdrant")
+            log.info(f"В Qdrant проиндексировано {total_indexed} чанков")
+            return total_indexed
 
         except Exception as e:
             log.error(f"Ошибка при добавлении чанков: {e}")
+            raise
 
-    def add_chunks_directly(self, chunks: List[Dict[str, str]]) -> int:
-        try:
-            points = []
+    @classmethod
+    def _iter_chunk_items(
+        cls,
+        scope: str,
+        chunks: Iterable[Dict[str, str]],
+        document_id: Optional[int],
+        user_id: Optional[int]
+    ) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        for chunk_data in chunks:
+            content = chunk_data.get("text", "")
 
-            for chunk_data in chunks:
-                content = chunk_data.get("text", "")
+            if not content:
+                log.warning("Пропущен чанк с пустым текстом")
+                continue
 
-                if not content:
-                    log.warning("Пропущен чанк с пустым текстом")
+            payload = {
+                "text": content,
+                "url": chunk_data.get("url", ""),
+                "title": chunk_data.get("title", ""),
+                "parsed_at": "",
+                "filename": "manual"
+            }
+            if document_id is not None:
+                payload["document_id"] = document_id
+            if user_id is not None:
+                payload["user_id"] = user_id
+
+            point_id, content, payload = cls._make_item(scope, content, payload)
+            payload["chunk_id"] = point_id
+
+            yield point_id, content, payload
+
+    @staticmethod
+    def _make_item(scope: str, content: str, payload: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+        """
+        Вычисляет id точки по хэшу содержимого.
+
+        В хэш входят текст и поля, которые выдаются в результатах поиска
+        (url, title); id одинаков при каждой переиндексации неизменного чанка.
+
+        Returns:
+            tuple: (id точки, текст для эмбеддинга, payload с content_hash)
+        """
+        fingerprint = "\x1f".join((content, payload.get("url", ""), payload.get("title", "")))
+        content_hash = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+        payload["content_hash"] = content_hash
+
+        point_id = str(uuid.uuid5(POINT_ID_NAMESPACE, f"{scope}:{content_hash}"))
+        return point_id, content, payload
+
+    def _sync_points(
+        self,
+        scope: str,
+        items: Iterable[Tuple[str, str, Dict[str, Any]]],
+        scope_filter: Optional[Filter],
+        on_progress: Optional[Callable[[int], None]] = None,
+        collection_name: Optional[str] = None
+    ) -> int:
+        """
+        Приводит точки области к переданному набору чанков.
+
+        Манифестом служат id точек области, уже лежащие в коллекции: кодируются
+        и загружаются только отсутствующие в нем чанки. Точки из манифеста,
+        которых нет среди чанков, удаляются после загрузки новых, поэтому
+        поиск не остается без данных. Если загрузка прервалась ошибкой,
+        ничего не удаляется.
+
+        Args:
+            scope: Область id (база знаний или документ)
+            items: Тройки (id точки, текст, payload)
+            scope_filter: Фильтр точек области; без него удаление не выполняется
+            on_progress: Вызывается с количеством загруженных точек после каждой пачки
+            collection_name: Коллекция для записи, по умолчанию collection_name
+
+        Returns:
+            int: Количество точек области после синхронизации
+        """
+        manifest = self._scroll_point_ids(scope_filter, collection_name) if scope_filter is not None else set()
+        seen: Set[str] = set()
+
+        def iter_missing() -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+            for point_id, content, payload in items:
+                if point_id in seen:
                     continue
+                seen.add(point_id)
+                if point_id not in manifest:
+                    yield point_id, content, payload
 
-                embedding = self.model.encode(content).tolist()
-
-                point = PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding,
-                    payload={
-                        "text": content,
-                        "url": chunk_data.get("url", ""),
-                        "title": chunk_data.get("title", ""),
-                        "parsed_at": "",
-                        "filename": "manual",
-                        "chunk_id": str(uuid.uuid4())
-                    }
-                )
+        uploaded = self._encode_and_upsert(
+            iter_missing(), on_progress=on_progress, collection_name=collection_name
+        )
 
-                points.append(point)
+        stale = list(manifest - seen) if seen else []
+        self._delete_points(stale, collection_name)
 
-            if not points:
-                log.error("Не удалось обработать ни одного чанка")
-                return 0
+        log.info(
+            f"Синхронизация '{scope}': загружено {uploaded}, без изменений {len(seen) - uploaded}, "
+            f"удалено {len(stale)}"
+        )
+        return len(seen)
 
-            total_uploaded = 0
+    def _delete_points(self, point_ids: List[str], collection_name: Optional[str] = None) -> None:
+        if not point_ids:
+            return
+
+        for target in self._write_targets(collection_name):
+            with self._mirror_errors(target, collection_name):
+                for i in range(0, len(point_ids), self.batch_size):
+                    self.client.delete(
+                        collection_name=target,
+                        points_selector=PointIdsList(points=point_ids[i:i + self.batch_size]),
+                        wait=True
+                    )
+
+    @contextmanager
+    def _mirror_errors(self, target: str, collection_name: Optional[str]):
+        """
+        Ошибка записи в теневую коллекцию не прерывает запись в основную:
+        пересборку могли отменить, а пропущенное догонит сверка перед переключением.
+        """
+        if collection_name or target == self.collection_name:
+            yield
+            return
+        try:
+            yield
+        except Exception as e:
+            log.warning(f"Не удалось продублировать запись в '{target}': {e}")
+
+    def _scroll_point_ids(self, scroll_filter: Optional[Filter], collection_name: Optional[str] = None) -> Set[str]:
+        point_ids: Set[str] = set()
+        offset = None
+
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name or self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False
+            )
+            point_ids.update(str(point.id) for point in points)
+            if offset is None:
+                return point_ids
+
+    def _encode_and_upsert(
+        self,
+        items: Iterable[Tuple[str, str, Dict[str, Any]]],
+        on_progress: Optional[Callable[[int], None]] = None,
+        collection_name: Optional[str] = None
+    ) -> int:
+        """
+        Кодирует тексты пачками и сразу отправляет каждую пачку в Qdrant.
+
+        Элементы читаются окнами по SORT_WINDOW_BATCHES пачек; внутри окна
+        тексты сортируются по длине, чтобы в пачке было меньше паддинга.
+        В памяти одновременно держится только одно окно. Тексты, уже
+        закодированные текущей моделью, берутся из хранилища эмбеддингов.
+
+        Args:
+            items: Тройки (id точки, текст для эмбеддинга, payload точки), в том числе генератор
+            on_progress: Вызывается с количеством загруженных точек после каждой пачки
+            collection_name: Коллекция для записи, по умолчанию collection_name
+
+        Returns:
+            int: Количество загруженных точек
+        """
+        items = iter(items)
+        total_uploaded = 0
+        # Есть ли разреженный вектор в коллекции записи; теневая коллекция пересборки может отличаться от текущей
+        with_sparse: Dict[str, bool] = {}
+        if collection_name:
+            with_sparse[collection_name] = self._supports_sparse(collection_name)
+        else:
+            self._refresh_hybrid_ready()
+            with_sparse[self.collection_name] = self._hybrid_ready
+
+        while True:
+            window = list(islice(items, self.encode_batch_size * SORT_WINDOW_BATCHES))
+            if not window:
+                break
+
+            window.sort(key=lambda item: len(item[1]), reverse=True)
+
+            for i in range(0, len(window), self.encode_batch_size):
+                batch = window[i:i + self.encode_batch_size]
+
+                embeddings = self._embed_batch(batch)
+
+                for target in self._write_targets(collection_name):
+                    with self._mirror_errors(target, collection_name):
+                        if target not in with_sparse:
+                            with_sparse[target] = self._supports_sparse(target)
+                        points = self._make_points(batch, embeddings, with_sparse[target])
+
+                        for j in range(0, len(points), self.batch_size):
+                            self.client.upsert(
+                                collection_name=target,
+                                points=points[j:j + self.batch_size],
+                                wait=True
+                            )
 
-            for i in range(0, len(points), self.batch_size):
-                batch = points[i:i + self.batch_size]
-                self.client.upsert(
-                    collection_name=self.collection_name,
-                    points=batch,
-                    wait=True
-                )
                 total_uploaded += len(batch)
-                log.info(f"Загружено {total_uploaded}/{len(points)} чанков")
+                log.info(f"Загружено {total_uploaded} чанков")
+                if on_progress is not None:
+                    on_progress(total_uploaded)
 
-            log.info(f"Успешно добавлено {len(points)} чанков в Qdrant")
-            return len(points)
+        return total_uploaded
 
-        except Exception as e:
-            log.error(f"Ошибка при добавлении чанков: {e}")
-            raise
+    def _make_points(
+        self,
+        batch: List[Tuple[str, str, Dict[str, Any]]],
+        embeddings: List[np.ndarray],
+        with_sparse: bool
+    ) -> List[PointStruct]:
+        return [
+            PointStruct(
+                id=point_id,
+                vector=(
+                    {"": embedding.tolist(), SPARSE_VECTOR_NAME: self.sparse_encoder.encode_document(content)}
+                    if with_sparse else embedding.tolist()
+                ),
+                payload=payload
+            )
+            for (point_id, content, payload), embedding in zip(batch, embeddings, strict=True)
+        ]
+
+    def _embed_batch(self, batch: List[Tuple[str, str, Dict[str, Any]]]) -> List[np.ndarray]:
+        """
+        Эмбеддинги пачки: готовые из хранилища эмбеддингов, остальные тексты
+        кодируются моделью и дописываются в хранилище.
+        """
+        embeddings: List[Optional[np.ndarray]] = [None] * len(batch)
+        missing = list(range(len(batch)))
+
+        if self.embedding_store is not None:
+            stored = self.embedding_store.get_many([batch[k][1] for k in missing])
+            for k, embedding in zip(missing, stored, strict=True):
+                embeddings[k] = embedding
+            missing = [k for k in missing if embeddings[k] is None]
+
+        if missing:
+            texts = [batch[k][1] for k in missing]
+            encoded = self.model.encode(texts, batch_size=self.encode_batch_size)
+            for k, embedding in zip(missing, encoded, strict=True):
+                embeddings[k] = embedding
+            if self.embedding_store is not None:
+                self.embedding_store.put_many(texts, encoded)
+
+        return embeddings
 
     def get_collection_info(self) -> Dict[str, Any]:
         try:
@@ -208,35 +1030,255 @@ class QdrantService:
             log.error(f"Ошибка при получении информации о коллекции: {e}")
             return {}
 
-    def search_similar(self, query: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def build_filter(document_id: Optional[int] = None, user_id: Optional[int] = None) -> Optional[Filter]:
+        conditions = []
+        if document_id is not None:
+            conditions.append(FieldCondition(key="document_id", match=MatchValue(value=document_id)))
+        if user_id is not None:
+            conditions.append(FieldCondition(key="user_id", match=MatchValue(value=user_id)))
+
+        return Filter(must=conditions) if conditions else None
+
+    def search_similar(
+        self,
+        query: str,
+        document_id: Optional[int] = None,
+        user_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Ищет чанки, похожие на запрос.
+
+        Args:
+            query: Текст запроса
+            document_id: Ограничить поиск чанками документа
+            user_id: Ограничить поиск чанками пользователя
+
+        Returns:
+            List[Dict[str, Any]]: Найденные чанки по убыванию score
+        """
         try:
-            query_embedding = self.model.encode(query).tolist()
+            query_embedding = self._encode_query(query)
 
-            search_results = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=self.top_samples
+            responses = self._query_batch_points(
+                lambda: [self._build_query_request(query, query_embedding, document_id, user_id)]
             )
 
-            results = []
-            for result in search_results:
-                results.append({
-                    "id": result.id,
-                    "score": result.score,
-                    "text": result.payload.get("text", ""),
-                    "link": result.payload.get("url", ""),
-                    "title": result.payload.get("title", ""),
-                    "parsed_at": result.payload.get("parsed_at", ""),
-                    "filename": result.payload.get("filename", ""),
-                    "chunk_id": result.payload.get("chunk_id", "")
-                })
-
-            return results
+            return [self._to_search_result(result) for result in responses[0].points]
 
         except Exception as e:
             log.error(f"Ошибка при поиске: {e}")
             return []
 
+    async def search_similar_async(
+        self,
+        query: str,
+        document_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Неблокирующий вариант search_similar для event loop.
+
+        Эмбеддинг запроса берется из кэша в памяти, иначе считается в пуле инференса.
+        Поиск идет через AsyncQdrantClient.
+
+        Args:
+            query: Текст запроса
+            document_id: Ограничить поиск чанками документа
+            user_id: Ограничить поиск чанками пользователя
+            query_embedding: Уже посчитанный эмбеддинг запроса
+        """
+        try:
+            if query_embedding is None:
+                query_embedding = await self.embed_query_async(query)
+
+            responses = await self._query_batch_points_async(
+                lambda: [self._build_query_request(query, query_embedding, document_id, user_id)]
+            )
+
+            return [self._to_search_result(result) for result in responses[0].points]
+
+        except Exception as e:
+            log.error(f"Ошибка при поиске: {e}")
+            return []
+
+    def search_batch(self, queries: List[SearchQuery]) -> List[List[Dict[str, Any]]]:
+        """
+        Ищет чанки сразу для нескольких запросов.
+
+        Тексты без эмбеддинга в кэше кодируются одним вызовом модели,
+        все поиски уходят в Qdrant одним запросом query_batch_points.
+
+        Args:
+            queries: Запросы со своими фильтрами и лимитами
+
+        Returns:
+            List[List[Dict[str, Any]]]: Результаты в порядке запросов
+        """
+        if not queries:
+            return []
+
+        try:
+            embeddings = self._encode_queries([query.query for query in queries])
+
+            batch_results = self._query_batch_points(lambda: self._build_search_requests(queries, embeddings))
+
+            return [[self._to_search_result(result) for result in response.points] for response in batch_results]
+
+        except Exception as e:
+            log.error(f"Ошибка при пакетном поиске: {e}")
+            return [[] for _ in queries]
+
+    async def search_batch_async(self, queries: List[SearchQuery]) -> List[List[Dict[str, Any]]]:
+        """Неблокирующий вариант search_batch: кодирование в пуле инференса, поиск через AsyncQdrantClient"""
+        if not queries:
+            return []
+
+        try:
+            embeddings = await run_inference(self._encode_queries, [query.query for query in queries])
+
+            batch_results = await self._query_batch_points_async(lambda: self._build_search_requests(queries, embeddings))
+
+            return [[self._to_search_result(result) for result in response.points] for response in batch_results]
+
+        except Exception as e:
+            log.error(f"Ошибка при пакетном поиске: {e}")
+            return [[] for _ in queries]
+
+    def _query_batch_points(self, build_requests: Callable[[], List[QueryRequest]]) -> List[Any]:
+        """
+        Выполняет запросы к коллекции за алиасом.
+
+        Запросы собираются после проверки _hybrid_ready: раз в hybrid_check_interval
+        и после ошибки запроса коллекция за алиасом перечитывается, и если
+        гибридный режим сменился, запрос повторяется один раз.
+        """
+        if self._hybrid_check_due():
+            self._refresh_hybrid_ready()
+
+        try:
+            return self.client.query_batch_points(collection_name=self.collection_name, requests=build_requests())
+        except Exception:
+            was_hybrid = self._hybrid_ready
+            self._refresh_hybrid_ready()
+            if self._hybrid_ready == was_hybrid:
+                raise
+            log.warning("Коллекция за алиасом сменилась, запрос повторяется")
+            return self.client.query_batch_points(collection_name=self.collection_name, requests=build_requests())
+
+    async def _query_batch_points_async(self, build_requests: Callable[[], List[QueryRequest]]) -> List[Any]:
+        """Неблокирующий вариант _query_batch_points через AsyncQdrantClient"""
+        if self._hybrid_check_due():
+            await self._refresh_hybrid_ready_async()
+
+        try:
+            return await self.async_client.query_batch_points(collection_name=self.collection_name, requests=build_requests())
+        except Exception:
+            was_hybrid = self._hybrid_ready
+            await self._refresh_hybrid_ready_async()
+            if self._hybrid_ready == was_hybrid:
+                raise
+            log.warning("Коллекция за алиасом сменилась, запрос повторяется")
+            return await self.async_client.query_batch_points(collection_name=self.collection_name, requests=build_requests())
+
+    def _build_search_requests(self, queries: List[SearchQuery], embeddings: List[List[float]]) -> List[QueryRequest]:
+        return [
+            self._build_query_request(query.query, embedding, query.document_id, query.user_id, query.limit)
+            for query, embedding in zip(queries, embeddings, strict=True)
+        ]
+
+    def _build_query_request(
+        self,
+        query: str,
+        embedding: List[float],
+        document_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> QueryRequest:
+        """
+        Собирает запрос к Qdrant.
+
+        В гибридном режиме векторный и BM25-поиск выполняются как prefetch
+        одного запроса, а их выдачи объединяются reciprocal rank fusion;
+        score результата в этом случае - оценка RRF, а не косинусная близость.
+        """
+        query_filter = self.build_filter(document_id, user_id)
+        limit = limit or self.top_samples
+        search_params = self._search_params()
+
+        sparse_query = self.sparse_encoder.encode_query(query) if self._hybrid_ready else None
+        if sparse_query is None or not sparse_query.indices:
+            return QueryRequest(query=embedding, filter=query_filter, limit=limit, params=search_params, with_payload=True)
+
+        prefetch_limit = max(self.hybrid_prefetch_limit, limit)
+        return QueryRequest(
+            prefetch=[
+                Prefetch(query=embedding, filter=query_filter, params=search_params, limit=prefetch_limit),
+                Prefetch(query=sparse_query, using=SPARSE_VECTOR_NAME, filter=query_filter, limit=prefetch_limit)
+            ],
+            query=FusionQuery(fusion=Fusion.RRF),
+            limit=limit,
+            with_payload=True
+        )
+
+    def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """Эмбеддинги запросов: из кэша, остальные (без повторов) - одним вызовом модели"""
+        embeddings: Dict[str, List[float]] = {}
+        for query in queries:
+            if query not in embeddings:
+                cached = self.embedding_cache.get(self.embedding_model_id, query)
+                if cached is not None:
+                    embeddings[query] = cached
+
+        missing = list(dict.fromkeys(query for query in queries if query not in embeddings))
+        if missing:
+            encoded = self.model.encode(missing, batch_size=self.encode_batch_size)
+            for query, embedding in zip(missing, encoded, strict=True):
+                embeddings[query] = embedding.tolist()
+                self.embedding_cache.put(self.embedding_model_id, query, embeddings[query])
+
+        return [embeddings[query] for query in queries]
+
+    async def embed_query_async(self, query: str) -> List[float]:
+        query_embedding = self.embedding_cache.get(self.embedding_model_id, query, memory_only=True)
+        if query_embedding is None:
+            if self.query_batcher is not None:
+                query_embedding = await self.query_batcher.submit(query)
+            else:
+                query_embedding = await run_inference(self._encode_query, query)
+        return query_embedding
+
+    def _encode_query(self, query: str) -> List[float]:
+        cached = self.embedding_cache.get(self.embedding_model_id, query)
+        if cached is not None:
+            return cached
+
+        embedding = self.model.encode(query).tolist()
+        self.embedding_cache.put(self.embedding_model_id, query, embedding)
+        return embedding
+
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        stats = self.embedding_cache.stats()
+        if self.embedding_store is not None:
+            stats["store"] = self.embedding_store.stats()
+        if self.query_batcher is not None:
+            stats["batcher"] = self.query_batcher.stats()
+        return stats
+
+    @staticmethod
+    def _to_search_result(result) -> Dict[str, Any]:
+        return {
+            "id": result.id,
+            "score": result.score,
+            "text": result.payload.get("text", ""),
+            "link": result.payload.get("url", ""),
+            "title": result.payload.get("title", ""),
+            "parsed_at": result.payload.get("parsed_at", ""),
+            "filename": result.payload.get("filename", ""),
+            "chunk_id": result.payload.get("chunk_id", ""),
+            "document_id": result.payload.get("document_id")
+        }
 
 async def main():
     qdrant_service = QdrantService()
@@ -244,6 +1286,7 @@ async def main():
     # chunks_dir = "../../data/chunks"
     # qdrant_service.clear_all_chunks()
     # qdrant_service.add_vectorized_chunks(chunks_dir)
+    # qdrant_service.rebuild_collection(chunks_dir)  # пересборка без остановки поиска
     # print("Чанки успешно добавлены в векторную БД")
     #
     info = qdrant_service.get_collection_info()
@@ -1,41 +1,198 @@
-import numpy as np
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from sentence_transformers import CrossEncoder
-from typing import List, Tuple
 
 from config.Config import CONFIG
+from core.services.MicroBatcher import MicroBatcher
+from core.services.inference_executor import run_inference
+from core.services.model_registry import get_cross_encoder
 from utils.logger import get_logger
 
 log = get_logger("RerankerService")
 
+
+@dataclass
+class RerankRequest:
+    query: str
+    documents: List[str]
+    vector_scores: Optional[List[float]] = None
+
+
 class RerankerService:
 
     def __init__(self):
         self.model_name = CONFIG.reranker.model_name
+        self.backend = CONFIG.reranker.backend
         self.top_samples = CONFIG.reranker.top_samples
+        self.batch_size = CONFIG.reranker.batch_size
+        self.max_length = CONFIG.reranker.max_length
+        self.min_vector_score = CONFIG.reranker.min_vector_score
+        self.score_cache_size = CONFIG.reranker.score_cache_size
+
+        self._score_cache: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self._score_cache_lock = threading.Lock()
+
+        # Реранкинг конкурентных запросов одним вызовом CrossEncoder, размер пачки - в парах
+        self.rerank_batcher: Optional[MicroBatcher[RerankRequest, List[Tuple[int, str, float]]]] = None
+        if CONFIG.inference.micro_batch_enabled:
+            self.rerank_batcher = MicroBatcher(
+                "rerank",
+                self.rerank_batch,
+                max_batch_size=CONFIG.inference.rerank_batch_max_pairs,
+                max_wait_ms=CONFIG.inference.micro_batch_max_wait_ms,
+                item_size=lambda request: len(request.documents)
+            )
+
+    @property
+    def model(self) -> CrossEncoder:
+        """CrossEncoder из общего реестра, загружается при первом обращении"""
+        return get_cross_encoder(self.model_name, self.max_length, self.backend)
+
+    def rerank(
+        self,
+        query: str,
+        documents: List[str],
+        vector_scores: Optional[List[float]] = None
+    ) -> List[Tuple[int, str, float]]:
+        """
+        Переранжирует документы по одному запросу.
+
+        Args:
+            query: Текст запроса
+            documents: Тексты кандидатов
+            vector_scores: Оценки векторного поиска для предварительного отсева
+
+        Returns:
+            List[Tuple[int, str, float]]: (исходный индекс, текст, оценка) по убыванию оценки
+        """
+        results = self.rerank_batch([RerankRequest(query, documents, vector_scores)])[0]
+        self._log_results(results)
+        return results
+
+    def rerank_batch(self, requests: List[RerankRequest]) -> List[List[Tuple[int, str, float]]]:
+        """
+        Переранжирует кандидатов нескольких запросов одним вызовом CrossEncoder.
+
+        Оценки из кэша (хэш запроса, хэш текста кандидата) не пересчитываются,
+        кандидаты с оценкой векторного поиска ниже min_vector_score отбрасываются.
+
+        Args:
+            requests: Запросы с кандидатами
 
-        try:
-            self.model = CrossEncoder(self.model_name)
-            log.info(f"Модель {self.model_name} загружена успешно")
-        except Exception as e:
-            log.error(f"Ошибка загрузки модели {self.model_name}: {e}")
-            raise
+        Returns:
+            List[List[Tuple[int, str, float]]]: Результаты в порядке запросов
+        """
+        all_scores: List[np.ndarray] = []
+        pending_pairs: List[List[str]] = []
+        pending_slots: List[Tuple[int, int, Tuple[str, str]]] = []
 
-    def rerank(self, query: str, documents: List[str]) -> List[Tuple[int, str, float]]:
+        for request_idx, request in enumerate(requests):
+            scores = np.full(len(request.documents), -np.inf, dtype=np.float32)
+            all_scores.append(scores)
+            query_hash = self._hash_query(request.query)
 
-        pairs = [[query, doc] for doc in documents]
+            for doc_idx in self._prefilter(request):
+                # Ключ по тексту: id чанков базы знаний не меняются при перенарезке страницы
+                cache_key = (query_hash, self._hash_text(request.documents[doc_idx]))
+                cached_score = self._get_cached_score(cache_key)
+                if cached_score is not None:
+                    scores[doc_idx] = cached_score
+                    continue
 
-        scores = self.model.predict(pairs)
+                pending_pairs.append([request.query, request.documents[doc_idx]])
+                pending_slots.append((request_idx, doc_idx, cache_key))
 
-        ranked_indices = np.argsort(scores)[::-1]
+        if pending_pairs:
+            predicted = self.model.predict(
+                pending_pairs,
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            for (request_idx, doc_idx, cache_key), score in zip(pending_slots, predicted, strict=True):
+                all_scores[request_idx][doc_idx] = score
+                self._put_cached_score(cache_key, float(score))
 
-        results = [
-            (idx, documents[idx], scores[idx])
-            for idx in ranked_indices[:self.top_samples]
-        ]
+        return [self._top_k(request, scores) for request, scores in zip(requests, all_scores, strict=True)]
 
+    async def rerank_async(
+        self,
+        query: str,
+        documents: List[str],
+        vector_scores: Optional[List[float]] = None
+    ) -> List[Tuple[int, str, float]]:
+        """
+        Неблокирующий вариант rerank: CrossEncoder выполняется в пуле инференса.
+
+        При включенном micro_batch_enabled кандидаты конкурентных запросов
+        оцениваются одним вызовом модели.
+        """
+        if self.rerank_batcher is None:
+            return await run_inference(self.rerank, query, documents, vector_scores)
+
+        results = await self.rerank_batcher.submit(RerankRequest(query, documents, vector_scores))
+        self._log_results(results)
+        return results
+
+    def get_score_cache_stats(self) -> Dict[str, int]:
+        with self._score_cache_lock:
+            return {"size": len(self._score_cache), "max_size": self.score_cache_size}
+
+    @staticmethod
+    def _log_results(results: List[Tuple[int, str, float]]) -> None:
         log.info("Результаты после реранкинга:")
         for i, (original_idx, doc_text, score) in enumerate(results[:5], 1):
             log.info(f"{i} чанк. [Score: {score:.4f}] (Исходный индекс: {original_idx})")
 
-        return results
+    def _prefilter(self, request: RerankRequest) -> List[int]:
+        indices = list(range(len(request.documents)))
+        if request.vector_scores is None or self.min_vector_score <= 0:
+            return indices
+
+        passed = [idx for idx in indices if request.vector_scores[idx] >= self.min_vector_score]
+        if not passed:
+            log.warning(f"Ни один кандидат не прошел порог {self.min_vector_score}, реранкинг по всем")
+            return indices
+
+        return passed
+
+    def _top_k(self, request: RerankRequest, scores: np.ndarray) -> List[Tuple[int, str, float]]:
+        candidates = int(np.isfinite(scores).sum())
+        k = min(self.top_samples, candidates)
+        if k == 0:
+            return []
+
+        top_indices = np.argpartition(-scores, k - 1)[:k]
+        top_indices = top_indices[np.argsort(-scores[top_indices])]
+
+        return [(int(idx), request.documents[idx], float(scores[idx])) for idx in top_indices]
+
+    @staticmethod
+    def _hash_query(query: str) -> str:
+        return hashlib.sha256(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _get_cached_score(self, key: Tuple[str, str]) -> Optional[float]:
+        if self.score_cache_size <= 0:
+            return None
+        with self._score_cache_lock:
+            score = self._score_cache.get(key)
+            if score is not None:
+                self._score_cache.move_to_end(key)
+            return score
+
+    def _put_cached_score(self, key: Tuple[str, str], score: float) -> None:
+        if self.score_cache_size <= 0:
+            return
+        with self._score_cache_lock:
+            self._score_cache[key] = score
+            self._score_cache.move_to_end(key)
+            while len(self._score_cache) > self.score_cache_size:
+                self._score_cache.popitem(last=False)
@@ -0,0 +1,56 @@
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List
+
+from qdrant_client.models import SparseVector
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class BM25SparseEncoder:
+    """
+    Лексический разреженный вектор для гибридного поиска.
+
+    Индекс токена - crc32 от его нижнего регистра, значение в документе -
+    BM25-насыщение частоты с нормировкой на длину. IDF считает Qdrant
+    (Modifier.IDF у разреженного вектора), поэтому у запроса все веса равны 1.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_length: float = 300.0):
+        """
+        Args:
+            k1: Насыщение частоты термина
+            b: Сила нормировки на длину документа
+            avg_doc_length: Средняя длина чанка в токенах-словах
+        """
+        self._k1: float = k1
+        self._b: float = b
+        self._avg_doc_length: float = avg_doc_length
+
+    def encode_document(self, text: str) -> SparseVector:
+        tokens = self._tokenize(text)
+        if not tokens:
+            return SparseVector(indices=[], values=[])
+
+        length_norm = self._k1 * (1 - self._b + self._b * len(tokens) / self._avg_doc_length)
+        weights: Dict[int, float] = {}
+        for index, tf in self._term_counts(tokens).items():
+            weights[index] = tf * (self._k1 + 1) / (tf + length_norm)
+
+        return SparseVector(indices=list(weights), values=list(weights.values()))
+
+    def encode_query(self, text: str) -> SparseVector:
+        indices = list(self._term_counts(self._tokenize(text)))
+        return SparseVector(indices=indices, values=[1.0] * len(indices))
+
+    @staticmethod
+    def _tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(text.lower())
+
+    @staticmethod
+    def _term_counts(tokens: List[str]) -> Dict[int, int]:
+        counts: Counter = Counter()
+        for token in tokens:
+            counts[zlib.crc32(token.encode("utf-8"))] += 1
+        return counts
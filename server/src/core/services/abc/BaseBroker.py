@@ -0,0 +1,47 @@
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict
+
+
+class BrokerMessage(ABC):
+    """Сообщение, полученное из брокера"""
+
+    @property
+    @abstractmethod
+    def body(self) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    async def ack(self) -> None:
+        """Подтверждает обработку сообщения"""
+        pass
+
+    @abstractmethod
+    async def reject(self) -> None:
+        """Отклоняет сообщение без возврата в очередь"""
+        pass
+
+
+class BaseBroker(ABC):
+    """Очередь задач для фоновой обработки"""
+
+    @abstractmethod
+    async def connect(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, message: Dict[str, Any], delay: float = 0.0) -> None:
+        """
+        Args:
+            message: Тело сообщения
+            delay: Через сколько секунд сообщение станет доступно потребителям;
+                до этого оно хранится в брокере и не занимает потребителя
+        """
+        pass
+
+    @abstractmethod
+    def consume(self) -> AsyncIterator[BrokerMessage]:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
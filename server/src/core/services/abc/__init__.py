@@ -1,5 +1,8 @@
+from core.services.abc.BaseBroker import BaseBroker, BrokerMessage
 from core.services.abc.BaseValidator import BaseValidator
 
 __all__ = [
     "BaseValidator",
+    "BaseBroker",
+    "BrokerMessage",
 ]
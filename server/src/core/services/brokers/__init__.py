@@ -0,0 +1,7 @@
+from core.services.brokers.in_memory_broker import InMemoryBroker
+from core.services.brokers.rabbitmq_broker import RabbitMQBroker
+
+__all__ = [
+    "InMemoryBroker",
+    "RabbitMQBroker",
+]
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from core.services.abc.BaseBroker import BaseBroker, BrokerMessage
+
+
+class InMemoryMessage(BrokerMessage):
+
+    def __init__(self, body: Dict[str, Any]):
+        self._body: Dict[str, Any] = body
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        return self._body
+
+    async def ack(self) -> None:
+        pass
+
+    async def reject(self) -> None:
+        pass
+
+
+class InMemoryBroker(BaseBroker):
+    """Брокер на asyncio.Queue внутри процесса (для тестов и локального запуска)"""
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._delayed: Set[asyncio.TimerHandle] = set()
+
+    async def connect(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+
+    async def publish(self, message: Dict[str, Any], delay: float = 0.0) -> None:
+        await self.connect()
+        if delay <= 0:
+            await self._queue.put(dict(message))
+            return
+
+        body = dict(message)
+
+        def release() -> None:
+            self._delayed.discard(handle)
+            self._queue.put_nowait(body)
+
+        handle = asyncio.get_running_loop().call_later(delay, release)
+        self._delayed.add(handle)
+
+    async def consume(self) -> AsyncIterator[BrokerMessage]:
+        await self.connect()
+        while True:
+            body = await self._queue.get()
+            self._queue.task_done()
+            yield InMemoryMessage(body)
+
+    async def close(self) -> None:
+        # Отложенные сообщения живут только в памяти процесса и при остановке теряются
+        for handle in self._delayed:
+            handle.cancel()
+        self._delayed.clear()
@@ -0,0 +1,117 @@
+import json
+from typing import Any, AsyncIterator, Dict, Set
+
+from core.services.abc.BaseBroker import BaseBroker, BrokerMessage
+from utils.logger import get_logger
+
+log = get_logger("RabbitMQBroker")
+
+
+class RabbitMQMessage(BrokerMessage):
+
+    def __init__(self, message):
+        self._message = message
+        self._body: Dict[str, Any] = json.loads(message.body.decode("utf-8"))
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        return self._body
+
+    async def ack(self) -> None:
+        await self._message.ack()
+
+    async def reject(self) -> None:
+        await self._message.reject(requeue=False)
+
+
+class RabbitMQBroker(BaseBroker):
+    """
+    Брокер на RabbitMQ: долговечная очередь, сообщения с persistent delivery.
+
+    Отложенные сообщения ждут в очереди {queue_name}.delay.{мс} с TTL на всю
+    очередь и по истечении перекладываются в основную очередь через
+    dead-lettering. Очередь на каждую задержку, а не TTL сообщения, потому что
+    RabbitMQ снимает просроченные сообщения только с головы очереди.
+    """
+
+    def __init__(self, url: str, queue_name: str, prefetch_count: int):
+        """
+        Args:
+            url: AMQP URL подключения
+            queue_name: Имя очереди задач
+            prefetch_count: Сколько неподтвержденных сообщений держать на потребителе
+        """
+        self._url: str = url
+        self._queue_name: str = queue_name
+        self._prefetch_count: int = prefetch_count
+        self._connection = None
+        self._channel = None
+        self._queue = None
+        self._delay_queues: Set[int] = set()
+
+    async def connect(self) -> None:
+        if self._connection is not None:
+            return
+
+        try:
+            import aio_pika
+        except ImportError as e:
+            raise ImportError("RabbitMQ broker requires the aio-pika package") from e
+
+        self._connection = await aio_pika.connect_robust(self._url)
+        self._channel = await self._connection.channel()
+        await self._channel.set_qos(prefetch_count=self._prefetch_count)
+        self._queue = await self._channel.declare_queue(self._queue_name, durable=True)
+        log.info(f"Подключение к RabbitMQ установлено, очередь '{self._queue_name}'")
+
+    async def publish(self, message: Dict[str, Any], delay: float = 0.0) -> None:
+        import aio_pika
+
+        await self.connect()
+        routing_key = self._queue_name
+        if delay > 0:
+            routing_key = await self._declare_delay_queue(int(delay * 1000))
+
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                body=json.dumps(message, ensure_ascii=False).encode("utf-8"),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key=routing_key
+        )
+
+    async def _declare_delay_queue(self, delay_ms: int) -> str:
+        name = f"{self._queue_name}.delay.{delay_ms}"
+        if delay_ms not in self._delay_queues:
+            await self._channel.declare_queue(
+                name,
+                durable=True,
+                arguments={
+                    "x-message-ttl": delay_ms,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self._queue_name
+                }
+            )
+            self._delay_queues.add(delay_ms)
+        return name
+
+    async def consume(self) -> AsyncIterator[BrokerMessage]:
+        await self.connect()
+        async with self._queue.iterator() as queue_iter:
+            async for message in queue_iter:
+                try:
+                    decoded = RabbitMQMessage(message)
+                except ValueError as e:
+                    log.error(f"Сообщение не разобрано и отклонено: {e}")
+                    await message.reject(requeue=False)
+                    continue
+                yield decoded
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+            self._channel = None
+            self._queue = None
+            self._delay_queues.clear()
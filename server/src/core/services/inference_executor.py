@@ -0,0 +1,33 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from config.Config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("InferenceExecutor")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    """Общий для процесса пул потоков под CPU-инференс (эмбеддинги, реранкинг)."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=CONFIG.inference.max_workers,
+                    thread_name_prefix="inference"
+                )
+                log.info(f"Пул инференса создан: {CONFIG.inference.max_workers} потоков")
+    return _executor
+
+
+async def run_inference(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Выполняет блокирующий вызов модели в пуле инференса, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), partial(func, *args, **kwargs))
@@ -0,0 +1,159 @@
+import copy
+import gc
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sentence_transformers import CrossEncoder, SentenceTransformer
+from transformers import AutoTokenizer
+
+from config.Config import CONFIG
+from core.services.onnx_backend import check_backend, load_onnx_model
+from utils.logger import get_logger
+
+log = get_logger("ModelRegistry")
+
+_models: Dict[Tuple[str, str, Optional[str], Tuple], Any] = {}
+_load_locks: Dict[Tuple[str, str, Optional[str], Tuple], threading.Lock] = {}
+_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def _device() -> Optional[str]:
+    return CONFIG.inference.device or None
+
+
+def _get_or_load(kind: str, model_name: str, options: Tuple, loader: Callable[[], Any]) -> Any:
+    key = (kind, model_name, _device(), options)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Модель грузится один раз, остальные потоки ждут ее, а не грузят свою копию
+    with load_lock:
+        model = _models.get(key)
+        if model is None:
+            log.info(f"Загрузка модели {model_name} ({kind} {options}, устройство: {_device() or 'auto'})...")
+            model = loader()
+            _models[key] = model
+            log.info(f"Модель {model_name} загружена")
+    return model
+
+
+def model_id(model_name: str, backend: str) -> str:
+    """Имя модели с бэкендом для ключей кэшей эмбеддингов: выходы ONNX/int8 немного отличаются от PyTorch"""
+    if backend == "onnx_int8":
+        return f"{model_name}@{backend}-{CONFIG.inference.onnx_quantization}"
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def _load(model_cls, model_name: str, backend: str, **kwargs: Any) -> Any:
+    check_backend(backend)
+    if backend == "torch":
+        return model_cls(model_name, device=_device(), **kwargs)
+    return load_onnx_model(model_cls, model_name, backend, device=_device(), **kwargs)
+
+
+def get_sentence_transformer(model_name: str, backend: str = "torch") -> SentenceTransformer:
+    """Общий для процесса SentenceTransformer: загружается при первом обращении."""
+    return _get_or_load(
+        "sentence_transformer",
+        model_name,
+        (backend,),
+        lambda: _load(SentenceTransformer, model_name, backend)
+    )
+
+
+def get_cross_encoder(model_name: str, max_length: int, backend: str = "torch") -> CrossEncoder:
+    """Общий для процесса CrossEncoder: загружается при первом обращении."""
+    return _get_or_load(
+        "cross_encoder",
+        model_name,
+        (max_length, backend),
+        lambda: _load(CrossEncoder, model_name, backend, max_length=max_length)
+    )
+
+
+def _load_tokenizer(model_name: str):
+    """
+    Токенизатор без весов модели, если модель еще не загружена в процесс.
+
+    Процессам, которым нужна только токенизация (нарезка чанков), не нужно
+    держать в памяти веса SentenceTransformer.
+    """
+    for (kind, name, _, _), model in list(_models.items()):
+        if kind == "sentence_transformer" and name == model_name:
+            return model.tokenizer
+
+    try:
+        return AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        # Токенизатор лежит не в корне репозитория модели (модули sentence-transformers)
+        log.warning(f"Токенизатор {model_name} не загружен отдельно, загружается модель: {e}")
+        return get_sentence_transformer(model_name).tokenizer
+
+
+def _shared_tokenizer(model_name: str):
+    return _get_or_load("tokenizer", model_name, (), lambda: _load_tokenizer(model_name))
+
+
+def get_tokenizer(model_name: str):
+    """
+    Токенизатор модели для текущего потока.
+
+    Быстрые токенизаторы HuggingFace нельзя вызывать из нескольких потоков
+    одновременно, поэтому каждый поток получает свою копию токенизатора.
+    """
+    tokenizers = getattr(_thread_local, "tokenizers", None)
+    if tokenizers is None:
+        tokenizers = _thread_local.tokenizers = {}
+
+    tokenizer = tokenizers.get(model_name)
+    if tokenizer is None:
+        tokenizer = copy.deepcopy(_shared_tokenizer(model_name))
+        tokenizers[model_name] = tokenizer
+    return tokenizer
+
+
+def load_models() -> None:
+    """Загружает все модели из конфига без вызова инференса."""
+    get_sentence_transformer(CONFIG.qdrant.model_name, CONFIG.qdrant.backend)
+    # ChunkProcessor нужен только токенизатор своей модели
+    _shared_tokenizer(CONFIG.chunks.model_name)
+    get_cross_encoder(CONFIG.reranker.model_name, CONFIG.reranker.max_length, CONFIG.reranker.backend)
+
+
+def warm_up_models() -> None:
+    """
+    Загружает модели из конфига и прогоняет через них короткий текст.
+
+    Вызывается при старте воркера, чтобы загрузка и инициализация ядер
+    не приходились на первый запрос пользователя.
+    """
+    load_models()
+    get_sentence_transformer(CONFIG.qdrant.model_name, CONFIG.qdrant.backend).encode(["warm up"])
+    get_cross_encoder(
+        CONFIG.reranker.model_name, CONFIG.reranker.max_length, CONFIG.reranker.backend
+    ).predict([("warm up", "warm up")])
+    log.info(f"Модели прогреты: {len(_models)}")
+
+
+def preload_models_before_fork() -> None:
+    """
+    Загружает модели в родительском процессе перед fork воркеров.
+
+    Веса модели остаются общими страницами copy-on-write для всех воркеров.
+    gc.freeze() переносит уже созданные объекты в постоянное поколение, чтобы
+    сборщик мусора в воркерах не трогал их заголовки и не копировал страницы.
+
+    Инференс в родителе не запускается: пулы потоков torch/OpenMP после fork
+    в дочернем процессе могут зависнуть. Прогрев - warm_up_models() в каждом
+    воркере после fork. Имеет смысл только при fork (например, gunicorn
+    с preload_app); воркеры, запущенные через spawn, загружают модели сами.
+    """
+    load_models()
+    gc.collect()
+    gc.freeze()
+    log.info("Модели загружены до fork воркеров")
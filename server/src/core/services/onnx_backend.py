@@ -0,0 +1,204 @@
+"""
+Экспорт моделей в ONNX Runtime и int8-квантование для CPU-инференса.
+
+Экспорт выполняется один раз и кэшируется в inference.onnx_cache_dir;
+при экспорте выходы ONNX-модели сверяются с исходной PyTorch-моделью,
+и модель, не прошедшая сверку, не используется.
+
+Экспорт заранее (из server/src):
+    python -m core.services.onnx_backend
+"""
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+import numpy as np
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from config.Config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("OnnxBackend")
+
+BACKENDS = ("torch", "onnx", "onnx_int8")
+PARITY_FILE = "parity.json"
+UNSAFE_PATH_CHARS = re.compile(r"[^\w.-]+")
+
+PARITY_TEXTS = [
+    "Как оформить возврат товара, купленного в интернет-магазине?",
+    "Срок гарантии на оборудование составляет 24 месяца с даты поставки.",
+    "Оплата производится в течение пяти банковских дней после подписания акта.",
+    "What documents are required to open a corporate account?",
+    "Контакты отдела продаж: телефон и электронная почта указаны на сайте.",
+    "Поставщик обязуется передать товар покупателю в согласованные сроки.",
+]
+
+Model = Union[SentenceTransformer, CrossEncoder]
+
+
+def check_backend(backend: str) -> None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}, expected one of {BACKENDS}")
+
+
+def _export_dir(model_name: str, backend: str, max_length: Optional[int] = None) -> Path:
+    """
+    Директория экспорта в кэше; в имени - все, от чего зависит результат экспорта:
+    бэкенд, набор инструкций квантования для onnx_int8 и max_length CrossEncoder.
+    """
+    variant = backend
+    if backend == "onnx_int8":
+        variant += f"-{CONFIG.inference.onnx_quantization}"
+    if max_length is not None:
+        variant += f"-len{max_length}"
+    return Path(CONFIG.inference.onnx_cache_dir) / UNSAFE_PATH_CHARS.sub("_", model_name) / variant
+
+
+def _find_onnx_file(export_dir: Path, backend: str) -> str:
+    """Путь к файлу графа относительно export_dir, как его ждет model_kwargs["file_name"]"""
+    pattern = f"model_qint8_{CONFIG.inference.onnx_quantization}.onnx" if backend == "onnx_int8" else "model.onnx"
+    found = sorted(export_dir.rglob(pattern))
+    if not found:
+        raise ValueError(f"ONNX file {pattern} not found in {export_dir}")
+    return found[0].relative_to(export_dir).as_posix()
+
+
+def load_onnx_model(model_cls: Type[Model], model_name: str, backend: str, **kwargs: Any) -> Model:
+    """
+    Загружает ONNX-вариант модели из кэша, при отсутствии экспортирует его.
+
+    Args:
+        model_cls: SentenceTransformer или CrossEncoder
+        model_name: Исходная модель
+        backend: onnx или onnx_int8
+        kwargs: Аргументы конструктора модели (device, max_length)
+
+    Returns:
+        SentenceTransformer | CrossEncoder: Модель с backend="onnx"
+
+    Raises:
+        ValueError: Если экспортированная модель не прошла сверку с исходной
+    """
+    export_dir = _export_dir(model_name, backend, kwargs.get("max_length"))
+    if not (export_dir / PARITY_FILE).exists():
+        export_model(model_cls, model_name, backend, **kwargs)
+
+    with open(export_dir / PARITY_FILE, encoding="utf-8") as f:
+        parity = json.load(f)
+    if not parity["passed"]:
+        raise ValueError(
+            f"ONNX model {model_name} ({backend}) failed parity check: {parity['metric']}={parity['value']:.4f} "
+            f"< {parity['threshold']}; remove {export_dir} to export it again"
+        )
+
+    return model_cls(
+        str(export_dir),
+        backend="onnx",
+        model_kwargs={"file_name": parity["file_name"], "provider": "CPUExecutionProvider"},
+        **kwargs
+    )
+
+
+def export_model(model_cls: Type[Model], model_name: str, backend: str, **kwargs: Any) -> Dict[str, Any]:
+    """
+    Экспортирует модель в ONNX (и квантует для onnx_int8) и сверяет с исходной.
+
+    Экспорт идет во временную директорию, которая подменяет директорию
+    кэша только целиком, вместе с результатом сверки.
+
+    Returns:
+        dict: Результат сверки, он же сохраняется в parity.json
+    """
+    check_backend(backend)
+    if backend == "torch":
+        raise ValueError("Backend 'torch' does not need export")
+
+    export_dir = _export_dir(model_name, backend, kwargs.get("max_length"))
+    tmp_dir = export_dir.with_name(f"{export_dir.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    log.info(f"Экспорт модели {model_name} в ONNX ({backend})...")
+    onnx_model = model_cls(model_name, backend="onnx", **kwargs)
+    onnx_model.save_pretrained(str(tmp_dir))
+    if backend == "onnx_int8":
+        # Есть в sentence-transformers>=3.2, нужен optimum[onnxruntime] (extra onnx); импорт только для onnx_int8
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        export_dynamic_quantized_onnx_model(
+            onnx_model,
+            quantization_config=CONFIG.inference.onnx_quantization,
+            model_name_or_path=str(tmp_dir),
+            push_to_hub=False
+        )
+
+    file_name = _find_onnx_file(tmp_dir, backend)
+    candidate = model_cls(
+        str(tmp_dir),
+        backend="onnx",
+        model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider"},
+        **kwargs
+    )
+    reference = model_cls(model_name, **kwargs)
+
+    metric, value = _parity(reference, candidate)
+    parity = {
+        "model_name": model_name,
+        "backend": backend,
+        "quantization": CONFIG.inference.onnx_quantization if backend == "onnx_int8" else None,
+        "max_length": kwargs.get("max_length"),
+        "file_name": file_name,
+        "metric": metric,
+        "value": value,
+        "threshold": CONFIG.inference.parity_threshold,
+        "passed": value >= CONFIG.inference.parity_threshold
+    }
+    with open(tmp_dir / PARITY_FILE, "w", encoding="utf-8") as f:
+        json.dump(parity, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(export_dir, ignore_errors=True)
+    export_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir.rename(export_dir)
+
+    if parity["passed"]:
+        log.info(f"Модель {model_name} ({backend}) экспортирована в {export_dir}, {metric}={value:.4f}")
+    else:
+        log.error(f"Модель {model_name} ({backend}) не прошла сверку с исходной: {metric}={value:.4f}")
+    return parity
+
+
+def _parity(reference: Model, candidate: Model) -> Tuple[str, float]:
+    """
+    Сверяет выходы моделей на PARITY_TEXTS.
+
+    Для эмбеддингов - минимальный косинус между векторами одного текста,
+    для CrossEncoder - корреляция Пирсона оценок всех пар запрос-текст.
+    """
+    if isinstance(reference, CrossEncoder):
+        pairs = [(query, text) for query in PARITY_TEXTS[:3] for text in PARITY_TEXTS]
+        expected = np.asarray(reference.predict(pairs, show_progress_bar=False), dtype=np.float64)
+        actual = np.asarray(candidate.predict(pairs, show_progress_bar=False), dtype=np.float64)
+        return "pearson", float(np.corrcoef(expected, actual)[0, 1])
+
+    expected = reference.encode(PARITY_TEXTS, normalize_embeddings=True)
+    actual = candidate.encode(PARITY_TEXTS, normalize_embeddings=True)
+    return "min_cosine", float(np.min(np.sum(expected * actual, axis=1)))
+
+
+def main():
+    exports: List[Tuple[Type[Model], str, str, Dict[str, Any]]] = [
+        (SentenceTransformer, CONFIG.qdrant.model_name, CONFIG.qdrant.backend, {}),
+        (CrossEncoder, CONFIG.reranker.model_name, CONFIG.reranker.backend, {"max_length": CONFIG.reranker.max_length}),
+    ]
+    for model_cls, model_name, backend, kwargs in exports:
+        if backend == "torch":
+            print(f"{model_name}: backend torch, экспорт не нужен")
+            continue
+        parity = export_model(model_cls, model_name, backend, **kwargs)
+        print(f"{model_name} ({backend}): {parity['metric']}={parity['value']:.4f}, сверка {'пройдена' if parity['passed'] else 'НЕ пройдена'}")
+
+
+if __name__ == "__main__":
+    main()
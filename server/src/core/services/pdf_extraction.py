@@ -0,0 +1,100 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional
+
+import fitz  # PyMuPDF
+
+
+class ParsedPdf:
+    """
+    Один раз прочитанный и разобранный PDF, общий для валидации, извлечения текста и подсчета страниц.
+
+    Файл читается в память целиком один раз, fitz открывает документ из этих байт
+    при первом обращении; ошибка разбора пробрасывается вызывающему.
+    """
+
+    def __init__(self, file_path: str):
+        self._file_path: str = file_path
+        self._data: Optional[bytes] = None
+        self._doc: Optional[fitz.Document] = None
+
+    @property
+    def file_path(self) -> str:
+        return self._file_path
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = Path(self._file_path).read_bytes()
+        return self._data
+
+    @property
+    def doc(self) -> fitz.Document:
+        if self._doc is None:
+            self._doc = fitz.open(stream=self.data, filetype="pdf")
+        return self._doc
+
+    @property
+    def page_count(self) -> int:
+        return len(self.doc)
+
+    def close(self) -> None:
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+        self._data = None
+
+    def __enter__(self) -> "ParsedPdf":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> list[str]:
+    """Извлекает текст страниц [start, end). Выполняется в процессе пула, поэтому модуль не тянет модели и конфиг."""
+    with fitz.open(pdf_path) as doc:
+        return [doc[page_num].get_text() for page_num in range(start, end)]
+
+
+def iter_page_texts(
+    pdf_path: str,
+    workers: int = 1,
+    parallel_min_pages: int = 100,
+    pdf: Optional[ParsedPdf] = None
+) -> Iterator[str]:
+    """
+    Отдает текст страниц PDF по порядку, не собирая документ целиком.
+
+    Большие документы делятся на диапазоны страниц, которые извлекаются
+    в пуле процессов; диапазоны отдаются по мере готовности в исходном порядке.
+
+    Args:
+        pdf_path: Путь к PDF
+        workers: Количество процессов для извлечения (1 - в текущем процессе)
+        parallel_min_pages: Минимальное число страниц для использования пула
+        pdf: Уже открытый документ; без него PDF открывается и закрывается здесь
+    """
+    owned = pdf is None
+    pdf = pdf or ParsedPdf(pdf_path)
+    try:
+        page_count = pdf.page_count
+        if workers <= 1 or page_count < parallel_min_pages:
+            for page in pdf.doc:
+                yield page.get_text()
+            return
+    finally:
+        if owned:
+            pdf.close()
+
+    range_size = max(1, -(-page_count // (workers * 4)))
+    ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [pool.submit(extract_page_range, pdf_path, start, end) for start, end in ranges]
+        for future in futures:
+            yield from future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -1,8 +1,8 @@
 import os
-from typing import List
-import fitz  # PyMuPDF
+from typing import List, Optional
 
 from core.services.abc.BaseValidator import BaseValidator
+from core.services.pdf_extraction import ParsedPdf
 from core.models.validation_result import ValidationResult
 
 
@@ -14,14 +14,16 @@ class DocumentValidator(BaseValidator):
     ALLOWED_EXTENSIONS: List[str] = ['.pdf']
     MAX_PAGE_COUNT: int = 500
 
-    def __init__(self, file_path: str, max_size_mb: int = MAX_FILE_SIZE_MB):
+    def __init__(self, file_path: str, max_size_mb: int = MAX_FILE_SIZE_MB, pdf: Optional[ParsedPdf] = None):
         """
         Args:
             file_path: Путь к файлу для валидации
             max_size_mb: Максимальный размер файла в МБ
+            pdf: Уже открытый документ, который переиспользуется после валидации
         """
         self._file_path: str = file_path
         self._max_size_mb: int = max_size_mb
+        self._pdf: Optional[ParsedPdf] = pdf
 
     def validate(self) -> ValidationResult:
         """
@@ -34,9 +36,21 @@ class DocumentValidator(BaseValidator):
         - Читаемость PDF (не поврежден, не зашифрован)
         - Количество страниц
 
+        PDF открывается один раз (или берется переданный) и используется
+        для проверки читаемости и подсчета страниц.
+
         Returns:
             ValidationResult: Результат валидации
         """
+        owned = self._pdf is None
+        pdf = self._pdf or ParsedPdf(self._file_path)
+        try:
+            return self._validate(pdf)
+        finally:
+            if owned:
+                pdf.close()
+
+    def _validate(self, pdf: ParsedPdf) -> ValidationResult:
         result = ValidationResult(is_valid=True)
 
         # 1. Проверка существования
@@ -57,13 +71,13 @@ class DocumentValidator(BaseValidator):
             )
 
         # 4. Проверка читаемости
-        is_readable, error_msg = self._is_readable()
+        is_readable, error_msg = self._is_readable(pdf)
         if not is_readable:
             result.add_error(error_msg)
             return result
 
         # 5. Проверка количества страниц
-        page_count = self._get_page_count()
+        page_count = self._get_page_count(pdf)
         if page_count > self.MAX_PAGE_COUNT:
             result.add_error(
                 f"Document has {page_count} pages, maximum allowed is {self.MAX_PAGE_COUNT}"
@@ -100,7 +114,7 @@ class DocumentValidator(BaseValidator):
         file_size_bytes = os.path.getsize(self._file_path)
         return file_size_bytes / (1024 * 1024)
 
-    def _is_readable(self) -> tuple[bool, str]:
+    def _is_readable(self, pdf: ParsedPdf) -> tuple[bool, str]:
         """
         Проверяет, читаем ли PDF (не поврежден, не зашифрован)
 
@@ -108,29 +122,24 @@ class DocumentValidator(BaseValidator):
             tuple[bool, str]: (is_readable, error_message)
         """
         try:
-            doc = fitz.open(self._file_path)
+            doc = pdf.doc
 
             # Проверка на шифрование
             if doc.is_encrypted:
-                doc.close()
                 return False, "PDF file is encrypted or password protected"
 
             # Попытка прочитать первую страницу
             if len(doc) > 0:
                 _ = doc[0].get_text()
 
-            doc.close()
             return True, ""
 
         except Exception as e:
             return False, f"PDF file is corrupted or cannot be read: {str(e)}"
 
-    def _get_page_count(self) -> int:
+    def _get_page_count(self, pdf: ParsedPdf) -> int:
         """Возвращает количество страниц в PDF"""
         try:
-            doc = fitz.open(self._file_path)
-            page_count = len(doc)
-            doc.close()
-            return page_count
+            return pdf.page_count
         except Exception:
             return 0
@@ -1,108 +1,261 @@
 import os
+import re
 import json
+import bisect
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-import fitz  # PyMuPDF
-
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from core.services.ChunkStore import ChunkStore, ChunkStoreWriter
+from core.services.model_registry import get_tokenizer
+from core.services.pdf_extraction import ParsedPdf, iter_page_texts
 from utils.logger import get_logger
 from config.Config import CONFIG
 
 log = get_logger("ChunksService")
 
+@dataclass
+class KbDirectoryReport:
+    total_files: int = 0
+    processed_files: int = 0
+    chunk_count: int = 0
+    failed: Dict[str, str] = field(default_factory=dict)  # имя файла -> ошибка
+
+    @property
+    def done_files(self) -> int:
+        return self.processed_files + len(self.failed)
+
 
 class ChunkProcessor:
     def __init__(self):
         self.chunk_size = CONFIG.chunks.chunk_size
         self.overlap = CONFIG.chunks.overlap
         self.model_name = CONFIG.chunks.model_name
-        log.info(f"Загрузка модели {self.model_name}...")
-        self.encoder = SentenceTransformer(self.model_name)
-        self.encoder.max_seq_length = CONFIG.chunks.encoder_max_seq_length
-        log.info(f"Модель загружена. Max sequence length: {self.encoder.get_max_seq_length()}")
+        self.extraction_workers = CONFIG.chunks.extraction_workers
+        self.parallel_extraction_min_pages = CONFIG.chunks.parallel_extraction_min_pages
+        self.kb_workers = CONFIG.chunks.kb_workers or os.cpu_count() or 1
+        self.store_shard_size = CONFIG.chunks.store_shard_size
+        # Сколько символов накопить перед очередной нарезкой потока (~4 чанка)
+        self.stream_cut_chars = self.chunk_size * 16
+
+    @property
+    def tokenizer(self):
+        """Токенизатор общей модели из реестра, свой для каждого потока"""
+        return get_tokenizer(self.model_name)
 
     def count_tokens(self, text: str) -> int:
-        tokens = self.encoder.tokenizer.encode(text)
+        tokens = self.tokenizer.encode(text)
         return len(tokens)
 
-    def create_chunks_with_overlap(self, text: str) -> list[str]:
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_tokens = 0
-
-        for word in words:
-            word_with_space = word + " "
-            word_tokens = self.count_tokens(word_with_space)
-
-            if current_tokens + word_tokens > self.chunk_size and current_chunk:
-                chunk_text = " ".join(current_chunk)
-                chunks.append(chunk_text)
-
-                overlap_words = []
-                overlap_tokens = 0
-                for w in reversed(current_chunk):
-                    w_with_space = w + " "
-                    w_tokens = self.count_tokens(w_with_space)
-                    if overlap_tokens + w_tokens > self.overlap:
-                        break
-                    overlap_words.insert(0, w)
-                    overlap_tokens += w_tokens
-
-                current_chunk = overlap_words
-                current_tokens = overlap_tokens
-
-            current_chunk.append(word)
-            current_tokens += word_tokens
-
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
+    def tokenize_words(self, text: str) -> tuple[list[tuple[int, int]], list[int]]:
+        """
+        Токенизирует весь текст за один вызов токенизатора.
+
+        Каждый токен относится к слову, в которое попадает его начало
+        по offset mapping, поэтому число токенов слов получается без
+        повторной токенизации.
+
+        Размер слова считается как у отдельно закодированного слова, вместе
+        со служебными токенами модели (<s>, </s>): так чанки совпадают с
+        прежней пословной нарезкой, и реальный чанк с запасом помещается
+        в max_seq_length энкодера и max_length реранкера.
+
+        Args:
+            text: Исходный текст
+
+        Returns:
+            tuple: (границы слов в тексте, префиксные суммы размеров слов)
+        """
+        spans = [(m.start(), m.end()) for m in re.finditer(r"\S+", text)]
+        counts = [0] * len(spans)
+
+        if not spans:
+            return spans, [0]
+
+        tokenizer = self.tokenizer
+        if tokenizer.is_fast:
+            encoding = tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                verbose=False
+            )
+            word_idx = 0
+            for token_start, token_end in encoding["offset_mapping"]:
+                if token_end <= token_start:
+                    continue
+                while word_idx + 1 < len(spans) and spans[word_idx + 1][0] <= token_start:
+                    word_idx += 1
+                counts[word_idx] += 1
+        else:
+            encoding = tokenizer(
+                [text[start:end] for start, end in spans],
+                add_special_tokens=False,
+                verbose=False
+            )
+            counts = [len(ids) for ids in encoding["input_ids"]]
+
+        special_tokens = tokenizer.num_special_tokens_to_add(pair=False)
+        prefix = [0]
+        for count in counts:
+            prefix.append(prefix[-1] + max(count, 1) + special_tokens)
+
+        return spans, prefix
+
+    def text_token_count(self, tokenized: tuple[list[tuple[int, int]], list[int]]) -> int:
+        """
+        Оценивает число токенов всего текста, как у count_tokens, по результату tokenize_words.
+
+        Служебные токены входят в размер каждого слова, а у целого текста они одни.
+        """
+        spans, prefix = tokenized
+        special_tokens = self.tokenizer.num_special_tokens_to_add(pair=False)
+        return prefix[-1] - (len(spans) - 1) * special_tokens
+
+    def create_chunks_with_overlap(
+        self,
+        text: str,
+        tokenized: tuple[list[tuple[int, int]], list[int]] | None = None
+    ) -> list[str]:
+        spans, prefix = tokenized or self.tokenize_words(text)
+        chunks, _, _ = self._cut_chunks(text, spans, prefix, final=True)
 
         log.info(f"Создано {len(chunks)} чанков")
         return chunks
 
-    def process_pdf(self, pdf_path: str, title: str = "") -> list[dict]:
-        try:
-            log.info(f"Начало обработки PDF: {pdf_path}")
-
-            doc = fitz.open(pdf_path)
-
-            full_text = ""
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                full_text += page.get_text()
-
-            doc.close()
+    def iter_chunks(self, pieces: Iterable[str], whole_if_fits: bool = False) -> Iterator[str]:
+        """
+        Нарезает на чанки текст, поступающий частями (например, по страницам).
+
+        Чанк отдается, как только следующее слово в него уже не помещается,
+        поэтому первые чанки доступны до того, как прочитан весь текст.
+        Результат совпадает с create_chunks_with_overlap по склеенному тексту.
+
+        Args:
+            pieces: Части текста по порядку
+            whole_if_fits: Отдать весь текст одним чанком, если он целиком меньше chunk_size токенов
+
+        Yields:
+            str: Очередной чанк
+        """
+        buffer = ""
+        pending_chars = 0
+        min_len = 1
+        yielded = False
+
+        for piece in pieces:
+            buffer += piece
+            pending_chars += len(piece)
+            if pending_chars < self.stream_cut_chars:
+                continue
+            pending_chars = 0
 
-            full_text = " ".join(full_text.split())
+            spans, prefix = self.tokenize_words(buffer)
+            # Последнее слово может продолжиться в следующей части
+            spans, prefix = spans[:-1], prefix[:-1]
 
-            if not full_text.strip():
-                log.warning(f"PDF файл {pdf_path} не содержит текста")
-                return []
+            chunks, start, min_len = self._cut_chunks(buffer, spans, prefix, final=False, min_len=min_len)
+            yielded = yielded or bool(chunks)
+            yield from chunks
 
-            token_count = self.count_tokens(full_text)
-            log.info(f"Извлечено {token_count} токенов из PDF")
+            if spans:
+                buffer = buffer[spans[start][0]:]
 
-            if token_count < self.chunk_size:
-                log.info(f"Текст меньше {self.chunk_size} токенов, создается один чанк")
-                return [{
-                    'text': full_text,
-                    'title': title or Path(pdf_path).stem,
-                    'url': ''
-                }]
+        spans, prefix = self.tokenize_words(buffer)
+        if whole_if_fits and not yielded and spans and self.text_token_count((spans, prefix)) < self.chunk_size:
+            log.info(f"Текст меньше {self.chunk_size} токенов, создается один чанк")
+            yield " ".join(buffer.split())
+            return
 
-            chunks = self.create_chunks_with_overlap(full_text)
+        chunks, _, _ = self._cut_chunks(buffer, spans, prefix, final=True, min_len=min_len)
+        yield from chunks
+
+    def _cut_chunks(
+        self,
+        text: str,
+        spans: list[tuple[int, int]],
+        prefix: list[int],
+        final: bool,
+        min_len: int = 1
+    ) -> tuple[list[str], int, int]:
+        """
+        Жадно режет слова на чанки по префиксным суммам размеров слов.
+
+        Args:
+            text: Текст, к которому относятся границы слов
+            spans: Границы слов
+            prefix: Префиксные суммы размеров слов из tokenize_words
+            final: Текст закончился; иначе последний чанк, в который еще помещаются слова, не отдается
+            min_len: Минимальная длина первого чанка в словах (перекрытие плюс вытеснившее его слово)
+
+        Returns:
+            tuple: (готовые чанки, индекс первого слова незавершенного чанка, его min_len)
+        """
+        words_count = len(spans)
+        chunks = []
 
-            result = []
-            for chunk_text in chunks:
-                result.append({
-                    'text': chunk_text,
-                    'title': title or Path(pdf_path).stem,
-                    'url': ''
-                })
+        start = 0
+        while start < words_count:
+            end = bisect.bisect_right(prefix, prefix[start] + self.chunk_size) - 1
+            end = min(max(end, start + min_len), words_count)
+
+            if end == words_count and not final:
+                break
+
+            chunk_text = text[spans[start][0]:spans[end - 1][1]]
+            chunks.append(" ".join(chunk_text.split()))
+
+            if end == words_count:
+                return chunks, words_count, 1
+
+            overlap_start = bisect.bisect_left(prefix, prefix[end] - self.overlap, lo=start, hi=end)
+            next_start = max(overlap_start, start + 1)
+            min_len = end + 1 - next_start
+            start = next_start
+
+        return chunks, start, min_len
+
+    def iter_pdf_chunks(self, pdf_path: str, title: str = "", pdf: ParsedPdf | None = None) -> Iterator[dict]:
+        """
+        Извлекает текст PDF постранично и отдает чанки по мере готовности.
+
+        Args:
+            pdf_path: Путь к PDF
+            title: Заголовок чанков (по умолчанию имя файла)
+            pdf: Уже открытый документ, чтобы не разбирать PDF повторно
+
+        Yields:
+            dict: Чанк с полями text, title, url
+        """
+        log.info(f"Начало обработки PDF: {pdf_path}")
+        title = title or Path(pdf_path).stem
+
+        pages = iter_page_texts(
+            pdf_path,
+            workers=self.extraction_workers,
+            parallel_min_pages=self.parallel_extraction_min_pages,
+            pdf=pdf
+        )
+
+        chunk_count = 0
+        for chunk_text in self.iter_chunks(pages, whole_if_fits=True):
+            chunk_count += 1
+            yield {
+                'text': chunk_text,
+                'title': title,
+                'url': ''
+            }
+
+        if chunk_count == 0:
+            log.warning(f"PDF файл {pdf_path} не содержит текста")
+        else:
+            log.info(f"PDF обработан: создано {chunk_count} чанк(ов)")
 
-            log.info(f"PDF обработан: создано {len(result)} чанк(ов)")
-            return result
+    def process_pdf(self, pdf_path: str, title: str = "") -> list[dict]:
+        try:
+            return list(self.iter_pdf_chunks(pdf_path, title))
 
         except Exception as e:
             log.error(f"Ошибка при обработке PDF {pdf_path}: {e}")
@@ -117,7 +270,8 @@ class ChunkProcessor:
             title = page_data.get('title', '')
             content = page_data.get('text', '')
 
-            token_count = self.count_tokens(content)
+            tokenized = self.tokenize_words(content)
+            token_count = self.text_token_count(tokenized)
             log.info(f"Обработка {Path(kb_page_path).name}: {token_count} токенов")
 
             if token_count < self.chunk_size:
@@ -128,7 +282,7 @@ class ChunkProcessor:
                     'content': content
                 }]
 
-            chunks = self.create_chunks_with_overlap(content)
+            chunks = self.create_chunks_with_overlap(content, tokenized)
 
             result = []
             for chunk_text in chunks:
@@ -144,43 +298,133 @@ class ChunkProcessor:
             log.error(f"Ошибка при обработке {kb_page_path}: {e}")
             raise
 
-    def save_chunks(self, chunks: list[dict], output_dir: str, base_name: str):
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
-
-        for i, chunk_data in enumerate(chunks, 1):
-            chunk_filename = output_path / f"{base_name}_chunk_{i}.json"
-            with open(chunk_filename, 'w', encoding='utf-8') as f:
-                json.dump(chunk_data, f, ensure_ascii=False, indent=2)
-
-            token_count = self.count_tokens(chunk_data['content'])
-            log.info(f"Сохранен {chunk_filename.name}: {token_count} токенов")
-
-    async def process_kb_directory(self, kb_dir: str, output_dir: str):
+    async def process_kb_directory(
+        self,
+        kb_dir: str,
+        output_dir: str,
+        on_progress: Optional[Callable[[KbDirectoryReport], None]] = None
+    ) -> KbDirectoryReport:
+        """
+        Нарезает страницы базы знаний kb_page_*.json на чанки и пишет их в хранилище чанков.
+
+        Нарезка (токенизация) идет в пуле из kb_workers процессов, запись -
+        последовательными дозаписями в шарды ChunkStore из отдельного потока.
+        Ошибка одного файла не останавливает обработку остальных: чанки
+        упавших страниц переносятся из предыдущей версии хранилища.
+        Хранилище в output_dir подменяется целиком после обработки всех файлов.
+
+        Args:
+            kb_dir: Директория со страницами базы знаний
+            output_dir: Директория хранилища чанков
+            on_progress: Вызывается после каждого обработанного или упавшего файла
+
+        Returns:
+            KbDirectoryReport: Количество обработанных файлов и чанков, ошибки по файлам
+        """
         kb_path = Path(kb_dir)
 
         if not kb_path.exists():
             log.error(f"Директория {kb_dir} не существует")
-            return
+            return KbDirectoryReport()
 
         kb_files = sorted(kb_path.glob("kb_page_*.json"))
-        log.info(f"Найдено {len(kb_files)} файлов для обработки")
+        report = KbDirectoryReport(total_files=len(kb_files))
+        if not kb_files:
+            log.warning(f"В директории {kb_dir} нет страниц базы знаний, хранилище не изменено")
+            return report
+        log.info(f"Найдено {len(kb_files)} файлов для обработки, процессов: {self.kb_workers}")
+
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        writer = ChunkStoreWriter(output_dir, shard_size=self.store_shard_size)
 
-        for kb_file in kb_files:
+        async def handle(kb_file: Path, pool: Optional[ProcessPoolExecutor]) -> None:
             try:
-                log.info(f"Обработка файла: {kb_file.name}")
-                chunks = self.process_kb_page(str(kb_file))
+                if pool is None:
+                    chunks = await asyncio.to_thread(self.process_kb_page, str(kb_file))
+                else:
+                    chunks = await loop.run_in_executor(pool, _process_kb_page_in_worker, str(kb_file))
 
-                base_name = kb_file.stem
+                async with write_lock:
+                    await asyncio.to_thread(self._write_page_chunks, writer, kb_file.stem, chunks)
 
-                self.save_chunks(chunks, output_dir, base_name)
-                log.info(f"Файл {kb_file.name} обработан: создано {len(chunks)} чанк(ов)")
+                report.processed_files += 1
+                report.chunk_count += len(chunks)
 
             except Exception as e:
+                report.failed[kb_file.name] = str(e)
                 log.error(f"Ошибка при обработке {kb_file.name}: {e}")
-                continue
 
-        log.info("Обработка всех файлов завершена!")
+            log.info(f"Обработано {report.done_files}/{report.total_files} файлов, чанков: {report.chunk_count}")
+            if on_progress is not None:
+                on_progress(report)
+
+        try:
+            if self.kb_workers <= 1 or len(kb_files) <= 1:
+                await asyncio.gather(*(handle(kb_file, None) for kb_file in kb_files))
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=min(self.kb_workers, len(kb_files)),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_kb_worker
+                ) as pool:
+                    await asyncio.gather(*(handle(kb_file, pool) for kb_file in kb_files))
+
+            if not report.processed_files:
+                raise ValueError("No knowledge base page was processed")
+
+            if report.failed:
+                await asyncio.to_thread(self._carry_over_failed_pages, writer, output_dir, report)
+
+            await asyncio.to_thread(writer.close)
+
+        except BaseException as e:
+            writer.abort()
+            log.error(f"Хранилище чанков {output_dir} не обновлено: {e}")
+            if isinstance(e, Exception):
+                return report
+            raise
+
+        log.info(
+            f"Обработка всех файлов завершена: {report.processed_files} файлов, {report.chunk_count} чанков, "
+            f"ошибок: {len(report.failed)}"
+        )
+        return report
+
+    @staticmethod
+    def _write_page_chunks(writer: ChunkStoreWriter, base_name: str, chunks: list[dict]) -> None:
+        for i, chunk_data in enumerate(chunks, 1):
+            writer.add({'chunk_id': f"{base_name}_chunk_{i}", **chunk_data})
+
+    @staticmethod
+    def _carry_over_failed_pages(writer: ChunkStoreWriter, output_dir: str, report: KbDirectoryReport) -> None:
+        """Переносит чанки страниц, которые не удалось обработать, из предыдущей версии хранилища"""
+        if not ChunkStore.exists(output_dir):
+            return
+
+        prefixes = tuple(f"{Path(name).stem}_chunk_" for name in report.failed)
+        carried = 0
+        with ChunkStore(output_dir) as previous:
+            for chunk_id in previous.chunk_ids():
+                if chunk_id.startswith(prefixes):
+                    writer.add(previous.get(chunk_id))
+                    carried += 1
+
+        if carried:
+            log.warning(f"Из предыдущей версии хранилища перенесено {carried} чанков упавших страниц")
+
+
+_worker_processor: Optional[ChunkProcessor] = None
+
+
+def _init_kb_worker() -> None:
+    global _worker_processor
+    _worker_processor = ChunkProcessor()
+
+
+def _process_kb_page_in_worker(kb_page_path: str) -> list[dict]:
+    """Нарезка страницы в процессе пула: токенизатор загружается один раз на процесс"""
+    return _worker_processor.process_kb_page(kb_page_path)
 
 
 async def main():